@@ -0,0 +1,109 @@
+"""
+Login latency under concurrent load.
+
+Runs the real /login route in-process against a throwaway SQLite database
+while other threads keep calling a cheap catalog endpoint, and reports the
+latency percentiles of both, so the cost of password hashing on the rest of
+the worker is visible.
+
+    $ python benchmarks/login.py --users 20 --concurrency 8 --requests 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def report(name, latencies, elapsed):
+    print("%-8s %6d req  %8.1f req/s  p50 %7.1fms  p95 %7.1fms  p99 %7.1fms  max %7.1fms" % (
+        name, len(latencies), len(latencies) / elapsed if elapsed else 0,
+        percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+        percentile(latencies, 99) * 1000, max(latencies or [0]) * 1000))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8, help="threads sending logins")
+    parser.add_argument("--requests", type=int, default=200, help="logins in total")
+    parser.add_argument("--background", type=int, default=2, help="threads calling GET /people/1 meanwhile")
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(), "login-benchmark.db")
+    os.environ["DATABASE_URL"] = "sqlite:///" + database
+    # The benchmark is the only client, do not let the limiter get in the way
+    os.environ.setdefault("LOGIN_RATE_LIMIT_IP", str(10 ** 9))
+    os.environ.setdefault("LOGIN_RATE_LIMIT_USER", str(10 ** 9))
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+    from flask_jwt_extended import create_access_token
+    from app import app, password_hasher
+    from models import db, User, Characters
+
+    with app.app_context():
+        db.create_all()
+        for index in range(args.users):
+            db.session.add(User(username="user%d" % index, firstname="Bench", lastname="Mark",
+                                email="user%d@example.com" % index, password=password_hasher.hash("secret%d" % index)))
+        db.session.add(Characters(name="Luke", description="Farm boy", gender="male", eye_color="blue"))
+        db.session.commit()
+        token = create_access_token(identity=1)
+
+    print("hash method %s, %d hash workers" % (app.config['PASSWORD_HASH_METHOD'], app.config['AUTH_HASH_WORKERS']))
+
+    login_latencies, other_latencies, failures = [], [], []
+    counter = iter(range(args.requests))
+    counter_lock = threading.Lock()
+    done = threading.Event()
+
+    def login_worker():
+        client = app.test_client()
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            user = index % args.users
+            started = time.perf_counter()
+            response = client.post("/login", json={"username": "user%d" % user, "password": "secret%d" % user})
+            login_latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                failures.append(response.status_code)
+
+    def background_worker():
+        client = app.test_client()
+        headers = {"Authorization": "Bearer " + token}
+        while not done.is_set():
+            started = time.perf_counter()
+            client.get("/people/1", headers=headers)
+            other_latencies.append(time.perf_counter() - started)
+
+    background = [threading.Thread(target=background_worker) for _ in range(args.background)]
+    workers = [threading.Thread(target=login_worker) for _ in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in background + workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    for thread in background:
+        thread.join()
+
+    report("login", login_latencies, elapsed)
+    report("get", other_latencies, elapsed)
+    if failures:
+        print("%d logins failed, status codes: %s" % (len(failures), sorted(set(failures))))
+    print("login mean %.1fms, stdev %.1fms" % (statistics.mean(login_latencies) * 1000,
+                                               statistics.pstdev(login_latencies) * 1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Bytes on the wire and encoding CPU per endpoint.
+
+Seeds a throwaway SQLite database, then for every endpoint prints the body
+size for each Content-Encoding the app can produce, the CPU time per request
+spent by the whole handler, and the time to JSON-encode the payload alone with
+Flask's default provider and with the orjson one.
+
+    $ python benchmarks/payloads.py --rows 2000 --repeat 50
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ENDPOINTS = [
+    "/people",
+    "/people?sort=name",
+    "/planets?limit=500",
+    "/vehicles/1",
+    "/users/favorites?embed=true",
+    "/favorites/top?type=planets&limit=100",
+]
+
+def cpu_per_call(function, repeat):
+    started = time.process_time()
+    for _ in range(repeat):
+        function()
+    return (time.process_time() - started) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000, help="rows per catalog table")
+    parser.add_argument("--favorites", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50, help="requests per measurement")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "payloads-benchmark.db")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+    from flask.json.provider import DefaultJSONProvider
+    from flask_jwt_extended import create_access_token
+    from app import app
+    from favorites import upsert_favorite
+    from models import db, User, Characters, Planets, Vehicles
+    from responses import FastJSONProvider, available_encodings, orjson
+    # Keep the per-request SQL log lines (see instrumentation.py) out of the report
+    logging.getLogger("sql").setLevel(logging.ERROR)
+
+    with app.app_context():
+        db.create_all()
+        user = User(username="bench", firstname="Bench", lastname="Mark", email="bench@example.com", password="-")
+        db.session.add(user)
+        for index in range(args.rows):
+            db.session.add(Characters(name="Character %d" % index, description="Lorem ipsum " * 8, gender="n/a",
+                                      eye_color="blue", hair_color="brown", skin_color="fair", birth_year="19BBY"))
+            db.session.add(Planets(name="Planet %d" % index, description="Lorem ipsum " * 8, diameter=index,
+                                   rotation_period=24, orbital_period=365, climate="arid"))
+            db.session.add(Vehicles(name="Vehicle %d" % index, description="Lorem ipsum " * 8, model="T-65",
+                                    vehicle_class="starfighter", manufacturer="Incom", length=12, crew=1, cargo_capacity=110))
+        db.session.commit()
+        for index in range(1, min(args.rows, args.favorites) + 1):
+            upsert_favorite(db.session, user.id, "planets", index)
+        db.session.commit()
+        token = create_access_token(identity=user.id)
+
+    client = app.test_client()
+    encodings = ["identity"] + available_encodings(app.config['COMPRESS_ENCODINGS'])
+    providers = {"flask": DefaultJSONProvider(app)}
+    if orjson is not None:
+        providers["orjson"] = FastJSONProvider(app)
+    print("encodings: %s   json providers: %s   compress above %d bytes" % (
+        ", ".join(encodings), ", ".join(providers), app.config['COMPRESS_MIN_SIZE']))
+
+    for path in ENDPOINTS:
+        print("\n" + path)
+        payload = None
+        for encoding in encodings:
+            headers = {"Authorization": "Bearer " + token, "Accept-Encoding": encoding}
+            response = client.get(path, headers=headers)
+            if encoding == "identity":
+                payload = json.loads(response.get_data())
+            cpu = cpu_per_call(lambda: client.get(path, headers=headers), args.repeat)
+            print("  %-9s %10d bytes  %8.2f ms cpu/request" % (encoding, len(response.get_data()), cpu))
+        for name, provider in providers.items():
+            cpu = cpu_per_call(lambda: provider.dumps(payload, separators=(",", ":")), args.repeat)
+            print("  json %-6s %8.2f ms to encode the payload" % (name, cpu))
+
+if __name__ == "__main__":
+    main()
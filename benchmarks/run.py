@@ -0,0 +1,270 @@
+"""
+Load test of the real API routes.
+
+Seeds a database with the requested volumes (a throwaway SQLite file unless
+--database-url points at an empty database, e.g. a local PostgreSQL), then runs
+each scenario with --concurrency threads through the Flask test client and
+reports throughput, latency percentiles, SQL statements per request and
+errors. Random choices are seeded, so two runs send the same requests.
+
+    $ python benchmarks/run.py --characters 5000 --planets 2000 --vehicles 2000 \\
+          --users 200 --favorites 5000 --concurrency 8 --requests 500
+
+Save a run with --output and compare a later one against it with --compare
+to spot regressions before deploying:
+
+    $ python benchmarks/run.py --output before.json
+    $ python benchmarks/run.py --compare before.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from login import percentile
+
+SCENARIOS = ("login", "list", "page", "get", "create", "update", "delete", "favorite", "favorites")
+
+COLLECTIONS = ("people", "planets", "vehicles")
+
+def character(rng, index):
+    return {"name": "Character %d" % index, "description": "Seeded character", "gender": rng.choice(["male", "female", "n/a"]),
+            "eye_color": rng.choice(["blue", "brown", "red"]), "hair_color": "brown", "skin_color": "fair", "birth_year": "19BBY"}
+
+def planet(rng, index):
+    return {"name": "Planet %d" % index, "description": "Seeded planet", "diameter": rng.randint(1000, 20000),
+            "rotation_period": 24, "orbital_period": 365, "population": rng.randint(0, 10 ** 6),
+            "climate": rng.choice(["arid", "temperate", "frozen"]), "terrain": rng.choice(["desert", "forest", "tundra"])}
+
+def vehicle(rng, index):
+    return {"name": "Vehicle %d" % index, "description": "Seeded vehicle", "model": "T-65", "vehicle_class": rng.choice(["starfighter", "walker"]),
+            "manufacturer": rng.choice(["Incom", "Kuat"]), "length": rng.randint(5, 50), "crew": rng.randint(1, 10),
+            "cargo_capacity": rng.randint(0, 1000)}
+
+def seed(args, rng):
+    from sqlalchemy import insert
+    from app import app, password_hasher
+    from favorites import TARGET_COLUMNS, rebuild_counts
+    from models import db, User, Characters, Planets, Vehicles, Favorites, CATALOG_MODELS, bump_collection_revision
+
+    with app.app_context():
+        db.create_all()
+        # Hashing is slow on purpose: every user shares the one hash
+        password = password_hasher.hash("benchmark")
+        db.session.execute(insert(User), [
+            {"username": "user%d" % index, "firstname": "Bench", "lastname": "Mark",
+             "email": "user%d@example.com" % index, "password": password, "is_active": True}
+            for index in range(args.users)
+        ])
+        for model, make, count in ((Characters, character, args.characters), (Planets, planet, args.planets),
+                                   (Vehicles, vehicle, args.vehicles)):
+            rows = [make(rng, index) for index in range(count)]
+            for start in range(0, len(rows), 1000):
+                db.session.execute(insert(model), rows[start:start + 1000])
+        for model in CATALOG_MODELS:
+            bump_collection_revision(db.session.connection(), model.__tablename__)
+
+        sizes = {"characters": args.characters, "planets": args.planets, "vehicles": args.vehicles}
+        favorites = set()
+        for _ in range(args.favorites * 3):
+            if len(favorites) >= args.favorites:
+                break
+            favorite_type = rng.choice([name for name, size in sizes.items() if size])
+            favorites.add((rng.randint(1, args.users), favorite_type, rng.randint(1, sizes[favorite_type])))
+        if favorites:
+            db.session.execute(insert(Favorites), [
+                {"user_id": user_id, "type": favorite_type, "char_id": None, "planet_id": None, "vehicle_id": None,
+                 TARGET_COLUMNS[favorite_type]: target_id}
+                for user_id, favorite_type, target_id in sorted(favorites)
+            ])
+        rebuild_counts(db.session)
+        db.session.commit()
+
+def make_requests(args):
+    """Scenario name -> function(client, rng, state) sending one request."""
+    sizes = {"people": args.characters, "planets": args.planets, "vehicles": args.vehicles}
+
+    def login(client, rng, state):
+        return client.post("/login", json={"username": "user%d" % rng.randrange(args.users), "password": "benchmark"})
+
+    def list_all(client, rng, state):
+        return client.get("/" + rng.choice(COLLECTIONS), headers=state["headers"](rng))
+
+    def page(client, rng, state):
+        collection = rng.choice(COLLECTIONS)
+        query = rng.choice(["limit=50", "limit=20&sort=-name", "limit=20&offset=100"])
+        return client.get("/%s?%s" % (collection, query), headers=state["headers"](rng))
+
+    def get(client, rng, state):
+        collection = rng.choice(COLLECTIONS)
+        return client.get("/%s/%d" % (collection, rng.randint(1, max(1, sizes[collection]))), headers=state["headers"](rng))
+
+    def create(client, rng, state):
+        response = client.post("/vehicles", json=vehicle(rng, rng.randrange(10 ** 6)), headers=state["headers"](rng))
+        if response.status_code == 201:
+            with state["lock"]:
+                state["created"].append(response.get_json()["id"])
+        return response
+
+    def update(client, rng, state):
+        item_id = rng.randint(1, max(1, args.vehicles))
+        return client.put("/vehicles/%d" % item_id, json=vehicle(rng, item_id), headers=state["headers"](rng))
+
+    def delete(client, rng, state):
+        with state["lock"]:
+            item_id = state["created"].pop() if state["created"] else None
+        if item_id is None:
+            item_id = client.post("/vehicles", json=vehicle(rng, 0), headers=state["headers"](rng)).get_json()["id"]
+        return client.delete("/vehicles/%d" % item_id, headers=state["headers"](rng))
+
+    def favorite(client, rng, state):
+        # Toggle: add a planet, or remove it when the user already has it
+        user = rng.randrange(args.users)
+        target = rng.randint(1, max(1, args.planets))
+        key = (user, target)
+        with state["lock"]:
+            remove = key in state["favorites"]
+            state["favorites"].symmetric_difference_update({key})
+        method = client.delete if remove else client.post
+        return method("/favorites/planets/%d" % target, headers=state["tokens"][user])
+
+    def favorites(client, rng, state):
+        return client.get("/users/favorites?embed=true", headers=state["headers"](rng))
+
+    return {"login": login, "list": list_all, "page": page, "get": get, "create": create, "update": update,
+            "delete": delete, "favorite": favorite, "favorites": favorites}
+
+def run_scenario(app, send, state, args, seed_value):
+    latencies, queries, errors = [], [], []
+    counter = iter(range(args.requests))
+    counter_lock = threading.Lock()
+
+    def worker(index):
+        client = app.test_client()
+        rng = random.Random("%s-%d" % (seed_value, index))
+        while True:
+            with counter_lock:
+                if next(counter, None) is None:
+                    return
+            state["queries"].count = 0
+            started = time.perf_counter()
+            response = send(client, rng, state)
+            latencies.append(time.perf_counter() - started)
+            queries.append(state["queries"].count)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "queries": sum(queries) / len(queries) if queries else 0.0,
+        "errors": len(errors),
+        "error_codes": sorted(set(errors)),
+    }
+
+def print_results(results, baseline=None):
+    print("%-10s %7s %10s %9s %9s %9s %8s %7s" % ("scenario", "req", "req/s", "p50 ms", "p95 ms", "p99 ms", "queries", "errors"))
+    for name, result in results.items():
+        print("%-10s %7d %10.1f %9.2f %9.2f %9.2f %8.2f %7d" % (
+            name, result["requests"], result["throughput"], result["p50"], result["p95"], result["p99"],
+            result["queries"], result["errors"]))
+        before = (baseline or {}).get(name)
+        if before:
+            print("%-10s %7s %+9.0f%% %+8.0f%% %+8.0f%% %+8.0f%% %+8.2f" % (
+                "  vs base", "", change(before["throughput"], result["throughput"]), change(before["p50"], result["p50"]),
+                change(before["p95"], result["p95"]), change(before["p99"], result["p99"]),
+                result["queries"] - before["queries"]))
+        if result["errors"]:
+            print("%-10s status codes: %s" % ("", result["error_codes"]))
+
+def change(before, after):
+    return (after - before) / before * 100 if before else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="empty database to seed instead of a temporary SQLite file")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--characters", type=int, default=1000)
+    parser.add_argument("--planets", type=int, default=1000)
+    parser.add_argument("--vehicles", type=int, default=1000)
+    parser.add_argument("--favorites", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=300, help="requests per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    args = parser.parse_args()
+    if args.users < 1:
+        parser.error("--users must be at least 1")
+
+    os.environ["DATABASE_URL"] = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    # The benchmark is the only client, do not let the login limiter get in the way
+    os.environ.setdefault("LOGIN_RATE_LIMIT_IP", str(10 ** 9))
+    os.environ.setdefault("LOGIN_RATE_LIMIT_USER", str(10 ** 9))
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+    from flask_jwt_extended import create_access_token
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from app import app
+    # Keep the per-request SQL log lines (see instrumentation.py) out of the report
+    logging.getLogger("sql").setLevel(logging.ERROR)
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    seed(args, rng)
+    print("seeded %d users, %d characters, %d planets, %d vehicles, %d favorites in %.1fs" % (
+        args.users, args.characters, args.planets, args.vehicles, args.favorites, time.perf_counter() - started))
+
+    # Statements are counted per thread, and each request runs on one thread
+    queries = threading.local()
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def count_query(connection, cursor, statement, parameters, context, executemany):
+        queries.count = getattr(queries, "count", 0) + 1
+
+    with app.app_context():
+        tokens = [{"Authorization": "Bearer " + create_access_token(identity=user_id, additional_claims={"is_active": True})}
+                  for user_id in range(1, args.users + 1)]
+    state = {
+        "tokens": tokens,
+        "headers": lambda rng: tokens[rng.randrange(len(tokens))],
+        "created": [],
+        "favorites": set(),
+        "lock": threading.Lock(),
+        "queries": queries,
+    }
+
+    requests = make_requests(args)
+    results = {}
+    for name in args.scenarios.split(","):
+        if name not in requests:
+            parser.error("unknown scenario %r" % name)
+        results[name] = run_scenario(app, requests[name], state, args, "%d-%s" % (args.seed, name))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"arguments": vars(args), "results": results}, file, indent=2)
+
+if __name__ == "__main__":
+    main()
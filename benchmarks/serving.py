@@ -0,0 +1,140 @@
+"""
+Sync (gunicorn sync workers) vs async (gunicorn + uvicorn workers, asgi.py)
+serving of the read endpoints.
+
+Seeds a throwaway SQLite database (or uses --database-url as is), starts each
+server in turn on a local port and has --concurrency threads fetch the
+catalog and favorites routes over HTTP, then prints throughput and latency
+percentiles per setup. Needs gunicorn, uvicorn and the async driver of the
+database installed.
+
+    $ python benchmarks/serving.py --workers 2 --concurrency 32 --requests 2000
+"""
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from login import report
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+PATHS = [
+    "/people/1",
+    "/planets?limit=20",
+    "/vehicles?crew_min=1&sort=-crew&limit=10",
+    "/users/favorites?embed=true",
+    "/favorites/top?type=planets",
+]
+
+SETUPS = {
+    "sync": ["gunicorn", "wsgi", "--chdir", SRC],
+    "async": ["gunicorn", "asgi:application", "--chdir", SRC, "-k", "uvicorn.workers.UvicornWorker"],
+}
+
+def seed(rows):
+    from flask_jwt_extended import create_access_token
+    from app import app
+    from favorites import upsert_favorite
+    from models import db, User, Characters, Planets, Vehicles
+
+    with app.app_context():
+        db.create_all()
+        user = User(username="bench", firstname="Bench", lastname="Mark", email="bench@example.com", password="-")
+        db.session.add(user)
+        for index in range(rows):
+            db.session.add(Characters(name="Character %d" % index, description="-", gender="n/a", eye_color="blue"))
+            db.session.add(Planets(name="Planet %d" % index, description="-", diameter=index, rotation_period=24,
+                                   orbital_period=365, climate="arid"))
+            db.session.add(Vehicles(name="Vehicle %d" % index, description="-", model="-", vehicle_class="-",
+                                    manufacturer="-", length=10, crew=index % 10, cargo_capacity=100))
+        db.session.commit()
+        for index in range(1, min(rows, 20) + 1):
+            upsert_favorite(db.session, user.id, "planets", index)
+        db.session.commit()
+        return create_access_token(identity=user.id)
+
+def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/people/1")
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("the server did not start on port %d" % port)
+
+def drive(port, token, concurrency, requests):
+    latencies, failures = [], []
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+
+    def worker():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        headers = {"Authorization": "Bearer " + token}
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            started = time.perf_counter()
+            connection.request("GET", PATHS[index % len(PATHS)], headers=headers)
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - started)
+            if response.status != 200:
+                failures.append(response.status)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, failures, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="use an existing, already seeded database")
+    parser.add_argument("--rows", type=int, default=500, help="rows per catalog table when seeding")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=32, help="client threads")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per setup")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--setups", default="sync,async")
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "serving-benchmark.db")
+    sys.path.insert(0, SRC)
+    if args.database_url:
+        from flask_jwt_extended import create_access_token
+        from app import app
+        with app.app_context():
+            token = create_access_token(identity=1)
+    else:
+        token = seed(args.rows)
+
+    for name in args.setups.split(","):
+        command = SETUPS[name] + ["--workers", str(args.workers), "--bind", "127.0.0.1:%d" % args.port]
+        server = subprocess.Popen(command, env=os.environ.copy(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(args.port)
+            drive(args.port, token, args.concurrency, len(PATHS) * 10)  # warm caches and pools
+            latencies, failures, elapsed = drive(args.port, token, args.concurrency, args.requests)
+        finally:
+            server.terminate()
+            server.wait()
+        report(name, latencies, elapsed)
+        if failures:
+            print("%d requests failed, status codes: %s" % (len(failures), sorted(set(failures))))
+
+if __name__ == "__main__":
+    main()
@@ -90,9 +90,18 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # the full-text search tables (SQLite) and indexes (PostgreSQL) are made by
+    # hand in migration a4d1e6b20c97, autogenerate must not drop them
+    def include_object(object, name, type_, reflected, compare_to):
+        if reflected and name is not None and (name.endswith('_search') or '_search_' in name):
+            return False
+        return True
+
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_object") is None:
+        conf_args["include_object"] = include_object
 
     connectable = get_engine()
 
@@ -0,0 +1,65 @@
+"""full-text search indexes
+
+Revision ID: a4d1e6b20c97
+Revises: f3c0a7d95e28
+Create Date: 2026-10-17 20:41:52.118406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d1e6b20c97'
+down_revision = 'f3c0a7d95e28'
+branch_labels = None
+depends_on = None
+
+TABLES = ('characters', 'planets', 'vehicles')
+
+# Must stay identical to search.TSVECTOR, or PostgreSQL will not use the index
+TSVECTOR = "setweight(to_tsvector('english', name), 'A') || setweight(to_tsvector('english', description), 'B')"
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for table in TABLES:
+            op.create_index('ix_%s_search' % table, table, [sa.text(TSVECTOR)], unique=False, postgresql_using='gin')
+    elif dialect == 'sqlite':
+        # External-content FTS5 tables: only the index is stored, the triggers
+        # keep it in step with every write, whatever code path makes it
+        for table in TABLES:
+            op.execute(
+                "CREATE VIRTUAL TABLE {0}_search USING fts5(name, description, content='{0}', "
+                "content_rowid='id', tokenize='porter unicode61')".format(table)
+            )
+            op.execute(
+                "CREATE TRIGGER {0}_search_insert AFTER INSERT ON {0} BEGIN "
+                "INSERT INTO {0}_search (rowid, name, description) VALUES (new.id, new.name, new.description); "
+                "END".format(table)
+            )
+            op.execute(
+                "CREATE TRIGGER {0}_search_delete AFTER DELETE ON {0} BEGIN "
+                "INSERT INTO {0}_search ({0}_search, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+                "END".format(table)
+            )
+            op.execute(
+                "CREATE TRIGGER {0}_search_update AFTER UPDATE OF name, description ON {0} BEGIN "
+                "INSERT INTO {0}_search ({0}_search, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+                "INSERT INTO {0}_search (rowid, name, description) VALUES (new.id, new.name, new.description); "
+                "END".format(table)
+            )
+            op.execute("INSERT INTO {0}_search ({0}_search) VALUES ('rebuild')".format(table))
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for table in TABLES:
+            op.drop_index('ix_%s_search' % table, table_name=table)
+    elif dialect == 'sqlite':
+        for table in TABLES:
+            for action in ('insert', 'delete', 'update'):
+                op.execute("DROP TRIGGER IF EXISTS {0}_search_{1}".format(table, action))
+            op.execute("DROP TABLE IF EXISTS {0}_search".format(table))
@@ -1,8 +1,22 @@
 import os
+from flask import current_app
 from flask_admin import Admin
+from werkzeug.security import generate_password_hash
 from models import db, User, Favorites, Characters, Planets, Vehicles
 from flask_admin.contrib.sqla import ModelView
 
+class UserView(ModelView):
+    column_exclude_list = ['password']
+
+    def on_model_change(self, form, model, is_created):
+        # Passwords typed in the admin are stored hashed like the API does
+        if form.password.data and not form.password.data.startswith(('pbkdf2:', 'scrypt:')):
+            model.password = generate_password_hash(form.password.data, method=current_app.config['PASSWORD_HASH_METHOD'])
+
+class CatalogView(ModelView):
+    # revision/updated_at are maintained by the flush hooks in models.py
+    form_excluded_columns = ['revision', 'updated_at']
+
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
@@ -10,11 +24,11 @@ def setup_admin(app):
 
     
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
+    admin.add_view(UserView(User, db.session))
     admin.add_view(ModelView(Favorites, db.session))
-    admin.add_view(ModelView(Characters, db.session))
-    admin.add_view(ModelView(Planets, db.session))
-    admin.add_view(ModelView(Vehicles, db.session))
+    admin.add_view(CatalogView(Characters, db.session))
+    admin.add_view(CatalogView(Planets, db.session))
+    admin.add_view(CatalogView(Vehicles, db.session))
 
     # You can duplicate that line to add mew models
     # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
@@ -2,17 +2,37 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
+import hashlib
+from datetime import datetime, timezone
+from flask import Flask, request, jsonify, url_for, stream_with_context
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from werkzeug.middleware.proxy_fix import ProxyFix
+from utils import APIException, generate_sitemap, paginate, wants_pagination, wants_filtering, apply_filters, parse_sort, sort_order
+from utils import parse_fields, load_fields, serialize_fields, parse_int_arg
 from admin import setup_admin
-from models import db, User, Favorites, Characters, Planets, Vehicles
+from commands import setup_commands
+from models import db, User, Favorites, Characters, Planets, Vehicles, CollectionRevision, CATALOG_TYPES, on_catalog_change
+from cache import make_cache
+from database import engine_options, PoolStats, ReplicaRouter, RoutingSession, use_replica
+from auth import PasswordHasher, HashingBusy, RateLimiter, setup_jwt, user_claims, internal_only
+from snapshot import CollectionSnapshot
+from responses import setup_json, setup_compression
+from instrumentation import setup_instrumentation
+from bulk import bulk_create, bulk_update, bulk_delete
+from favorites import TARGET_COLUMNS, TYPE_ALIASES, TargetNotFound, upsert_favorite, remove_favorite, find_favorite, top_targets
+from favorites import validate_operations, apply_operations
+from search import CatalogSearch, load_results
+from autocomplete import AutocompleteIndex
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 #from models import Person
 
 from flask_jwt_extended import create_access_token
 from flask_jwt_extended import get_jwt_identity
+from flask_jwt_extended import get_jwt
 from flask_jwt_extended import jwt_required
 from flask_jwt_extended import JWTManager
 
@@ -20,6 +40,11 @@ app = Flask(__name__)
 app.url_map.strict_slashes = False
 
 app.config["JWT_SECRET_KEY"] = "super-secret"  # Change this "super secret" with something else!
+# How protected endpoints check the user: claims (token only), cache or db
+app.config['JWT_USER_CHECK'] = os.getenv("JWT_USER_CHECK", "claims")
+app.config['JWT_IDENTITY_CACHE_TTL'] = int(os.getenv("JWT_IDENTITY_CACHE_TTL", 60))
+# How often each worker re-reads the token_revocations table (without Redis)
+app.config['JWT_REVOCATION_SYNC_SECONDS'] = float(os.getenv("JWT_REVOCATION_SYNC_SECONDS", 1))
 jwt = JWTManager(app)
 
 db_url = os.getenv("DATABASE_URL")
@@ -28,35 +53,427 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool sizing, pre-ping, recycling and statement timeouts (see database.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+# Optional read replicas for the catalog/favorites GET handlers
+app.config['DATABASE_REPLICA_URLS'] = [url.strip().replace("postgres://", "postgresql://")
+                                       for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+app.config['REPLICA_RETRY_SECONDS'] = int(os.getenv("REPLICA_RETRY_SECONDS", 30))
+# Shared secret for the /internal endpoints (X-Internal-Key header); unset hides them
+app.config['INTERNAL_API_KEY'] = os.getenv("INTERNAL_API_KEY")
+
+# List endpoints paginate when ?limit=, ?after= or ?offset= is given
+app.config['PAGINATION_DEFAULT_LIMIT'] = int(os.getenv("PAGINATION_DEFAULT_LIMIT", 50))
+app.config['PAGINATION_MAX_LIMIT'] = int(os.getenv("PAGINATION_MAX_LIMIT", 500))
+app.config['PAGINATION_MAX_OFFSET'] = int(os.getenv("PAGINATION_MAX_OFFSET", 1000))
+
+# Write endpoints answer with the mutated resource only. Old clients that still
+# expect the whole table back can send ?legacy=true (or set this to true).
+app.config['LEGACY_WRITE_RESPONSES'] = os.getenv("LEGACY_WRITE_RESPONSES", "false").lower() == "true"
+
+# Read-through cache for single catalog entities: memory (LRU + TTL), redis or none.
+# Redis is shared and invalidated on every write. With memory each worker has
+# its own copy and only hears about its own writes, so the other workers may
+# serve an entry up to CACHE_TTL seconds old; CACHE_VERIFY=true closes that
+# window by checking the row revision on every hit (one indexed lookup).
+app.config['CACHE_BACKEND'] = os.getenv("CACHE_BACKEND", "memory")
+app.config['CACHE_TTL'] = int(os.getenv("CACHE_TTL", 300))
+app.config['CACHE_VERIFY'] = os.getenv("CACHE_VERIFY", "false").lower() == "true"
+app.config['CACHE_MAX_ENTRIES'] = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+app.config['CACHE_REDIS_URL'] = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+# Rows fetched per round trip by the streaming /export endpoints
+app.config['EXPORT_BATCH_SIZE'] = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+# Upper bound on the number of items accepted by one /<collection>/bulk call
+app.config['BULK_MAX_ITEMS'] = int(os.getenv("BULK_MAX_ITEMS", 10000))
+
+# Upper bound on the number of operations accepted by one /favorites/batch call
+app.config['FAVORITES_BATCH_MAX'] = int(os.getenv("FAVORITES_BATCH_MAX", 500))
+
+# Password hashing work factor and the size of the pool that runs it
+app.config['PASSWORD_HASH_METHOD'] = os.getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+app.config['AUTH_HASH_WORKERS'] = int(os.getenv("AUTH_HASH_WORKERS", 2))
+# Seconds a login or registration may wait for the pool before answering 503
+app.config['AUTH_HASH_TIMEOUT'] = int(os.getenv("AUTH_HASH_TIMEOUT", 10))
+
+# Login attempts allowed per window (seconds), counted per IP and per username
+app.config['LOGIN_RATE_LIMIT_IP'] = int(os.getenv("LOGIN_RATE_LIMIT_IP", 100))
+app.config['LOGIN_RATE_LIMIT_USER'] = int(os.getenv("LOGIN_RATE_LIMIT_USER", 20))
+app.config['LOGIN_RATE_LIMIT_WINDOW'] = int(os.getenv("LOGIN_RATE_LIMIT_WINDOW", 60))
+# Reverse proxies in front of the app (Render, Heroku: 1). Their X-Forwarded-*
+# headers are trusted for this many hops, so request.remote_addr is the client
+# and not the proxy, which the per-IP login limit relies on. Leave it at 0 when
+# clients reach gunicorn directly, or they could pick their own address.
+app.config['PROXY_FIX_HOPS'] = int(os.getenv("PROXY_FIX_HOPS", 0))
+
+# Responses at least this big are compressed for clients that accept it
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+app.config['COMPRESS_ENCODINGS'] = os.getenv("COMPRESS_ENCODINGS", "zstd,br,gzip").split(",")
+
+# Full-text search backend: auto (database index when available) or memory
+app.config['SEARCH_BACKEND'] = os.getenv("SEARCH_BACKEND", "auto")
+
+# Seconds between checks for catalog writes made outside this worker
+app.config['AUTOCOMPLETE_REFRESH_SECONDS'] = int(os.getenv("AUTOCOMPLETE_REFRESH_SECONDS", 30))
+
+# Per-request SQL statistics: Server-Timing header and a JSON log line per
+# request, flagged when a statement repeats SQL_REPEAT_THRESHOLD times or more
+app.config['SQL_INSTRUMENTATION'] = os.getenv("SQL_INSTRUMENTATION", "true").lower() == "true"
+app.config['SQL_SERVER_TIMING'] = os.getenv("SQL_SERVER_TIMING", "true").lower() == "true"
+app.config['SQL_SLOWEST_STATEMENTS'] = int(os.getenv("SQL_SLOWEST_STATEMENTS", 3))
+app.config['SQL_REPEAT_THRESHOLD'] = int(os.getenv("SQL_REPEAT_THRESHOLD", 5))
+
+if app.config['PROXY_FIX_HOPS']:
+    hops = app.config['PROXY_FIX_HOPS']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops, x_port=hops)
 
 MIGRATE = Migrate(app, db)
 db.init_app(app)
+with app.app_context():
+    pool_stats = [PoolStats(db.engine)]
+if app.config['DATABASE_REPLICA_URLS']:
+    RoutingSession.router = ReplicaRouter(app.config['DATABASE_REPLICA_URLS'], app.config['REPLICA_RETRY_SECONDS'])
+    pool_stats += [PoolStats(engine) for engine in RoutingSession.router.engines]
 CORS(app)
 setup_admin(app)
+setup_commands(app)
+setup_jwt(app, jwt)
+setup_json(app)
+setup_compression(app)
+setup_instrumentation(app)
+entity_cache = make_cache(app.config)
+password_hasher = PasswordHasher(app.config['PASSWORD_HASH_METHOD'], workers=app.config['AUTH_HASH_WORKERS'],
+                                 timeout=app.config['AUTH_HASH_TIMEOUT'])
+login_limiter_ip = RateLimiter(app.config['LOGIN_RATE_LIMIT_IP'], app.config['LOGIN_RATE_LIMIT_WINDOW'])
+login_limiter_user = RateLimiter(app.config['LOGIN_RATE_LIMIT_USER'], app.config['LOGIN_RATE_LIMIT_WINDOW'])
+catalog_search = CatalogSearch(app.config['SEARCH_BACKEND'])
+autocomplete_index = AutocompleteIndex(app.config['AUTOCOMPLETE_REFRESH_SECONDS'])
+
+# Runs after every commit that touched the catalog, including Flask-Admin edits
+@on_catalog_change
+def invalidate_entity_cache(changes):
+    entity_cache.delete(*[entity_key(table, item_id) for table, item_id, action in changes])
+
+@on_catalog_change
+def update_autocomplete_index(changes):
+    autocomplete_index.apply(changes)
+
+def encode_row(payload):
+    # Same bytes jsonify would produce for this dict inside a list
+    return app.json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+snapshots = {model: CollectionSnapshot(model, encode_row) for model in (Characters, Planets, Vehicles)}
+
+def entity_key(table, item_id):
+    return "%s:%d" % (table, item_id)
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
+@app.errorhandler(HashingBusy)
+def handle_hashing_busy(error):
+    retry_after = str(app.config['AUTH_HASH_TIMEOUT'])
+    return jsonify({"msg": "Too many logins in progress, try again later"}), 503, {"Retry-After": retry_after}
+
 # generate sitemap with all your endpoints
 @app.route('/')
 def sitemap():
     return generate_sitemap(app)
 
+# Conditional GET: every collection has a revision counter in
+# collection_revisions and each written row takes the counter's new value as
+# its own revision (see bump_collection_revision), so a row ETag is never
+# reused, not even by a row that gets the id of a deleted one. Validators are
+# cheap to compute and a matching If-None-Match is answered before any row
+# body is loaded.
+
+def resource_etag(model, item_id, revision, fields=None):
+    etag = "%s-%d-%d" % (model.__tablename__, item_id, revision)
+    if fields:
+        etag += "-" + hashlib.sha1(",".join(fields).encode("utf-8")).hexdigest()[:8]
+    return etag
+
+def collection_etag(model, revision):
+    # The representation depends on the query string (paging, filters, fields)
+    args = hashlib.sha1(request.query_string).hexdigest()[:12]
+    return "%s-%d-%s" % (model.__tablename__, revision, args)
+
+def http_date(value):
+    return value.replace(tzinfo=timezone.utc, microsecond=0) if value is not None else None
+
+def not_modified(etag, last_modified):
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified is not None:
+        matched = http_date(last_modified) <= request.if_modified_since
+    else:
+        matched = False
+
+    if not matched:
+        return None
+    response = app.response_class(status=304)
+    set_validators(response, etag, last_modified)
+    return response
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = http_date(last_modified)
+    return response
+
+def is_conditional():
+    return bool(request.if_none_match) or request.if_modified_since is not None
+
+def load_entity(model, item_id, revision=None):
+    # A cached entry is reloaded when it is older than the given row revision
+    key = entity_key(model.__tablename__, item_id)
+    entry = entity_cache.get(key)
+    if entry is not None and (revision is None or entry["revision"] == revision):
+        return entry
+
+    item = db.session.get(model, item_id)
+    if item is None:
+        return None
+    entry = {
+        "data": item.serialize(),
+        "revision": item.revision,
+        "updated_at": item.updated_at.isoformat(),
+    }
+    entity_cache.set(key, entry)
+    return entry
+
+def item_response(model, item_id):
+    fields = parse_fields(model, request.args)
+    key = entity_key(model.__tablename__, item_id)
+    revision = None
+    # Cache hits are served without a query unless CACHE_VERIFY is set
+    if app.config['CACHE_VERIFY'] or is_conditional() and entity_cache.get(key) is None:
+        version = db.session.query(model.revision, model.updated_at).filter(model.id == item_id).first()
+        if version is None:
+            return jsonify([])
+        cached = not_modified(resource_etag(model, item_id, version.revision, fields), version.updated_at)
+        if cached is not None:
+            return cached
+        revision = version.revision
+
+    entry = load_entity(model, item_id, revision)
+    if entry is None:
+        return jsonify([])
+
+    etag = resource_etag(model, item_id, entry["revision"], fields)
+    last_modified = datetime.fromisoformat(entry["updated_at"])
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        return cached
+    data = entry["data"] if fields is None else {name: entry["data"][name] for name in fields}
+    return set_validators(jsonify([data]), etag, last_modified)
+
+def list_response(model):
+    version = db.session.get(CollectionRevision, model.__tablename__)
+    revision = version.revision if version else 0
+    etag = collection_etag(model, revision)
+    last_modified = version.updated_at if version else None
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        return cached
+
+    return set_validators(build_list_response(model, revision), etag, last_modified)
+
+def build_list_response(model, revision):
+    filtered = wants_filtering(model, request.args)
+    fields = parse_fields(model, request.args)
+    sort = parse_sort(model, request.args)
+    query = apply_filters(model.query, model, request.args)
+    if fields is None:
+        serialize = model.serialize
+    else:
+        query = load_fields(query, model, fields, sort)
+        serialize = lambda item: serialize_fields(item, fields)
+
+    # Without paging arguments keep returning the plain list old clients expect,
+    # served from the pre-encoded snapshot of the collection when possible
+    if not wants_pagination(request.args):
+        if not filtered and fields is None:
+            body = snapshots[model].get(db.session, revision)
+            response = app.response_class(body, mimetype=app.json.mimetype)
+            response.compressed_variants = snapshots[model].variants(body)
+            return response
+        return jsonify([serialize(item) for item in query.order_by(*sort_order(model, sort)).all()])
+
+    items, next_cursor, next_offset = paginate(
+        query, model, request.args, sort=sort,
+        default_limit=app.config['PAGINATION_DEFAULT_LIMIT'],
+        max_limit=app.config['PAGINATION_MAX_LIMIT'],
+        max_offset=app.config['PAGINATION_MAX_OFFSET'],
+    )
+    result = {"results": [serialize(item) for item in items]}
+    if request.args.get("offset"):
+        result["next_offset"] = next_offset
+    else:
+        result["next"] = next_cursor
+    return jsonify(result)
+
+def legacy_write_response():
+    if app.config['LEGACY_WRITE_RESPONSES']:
+        return True
+    return request.args.get('legacy', '').lower() in ('1', 'true', 'yes')
+
+def write_response(payload, legacy_query, status=200, location=None, etag=None):
+    # legacy_query is only executed for clients that opted into the old behaviour
+    if legacy_write_response():
+        return jsonify([item.serialize() for item in legacy_query.all()]), 200
+
+    response = jsonify(payload)
+    response.status_code = status
+    if etag is not None:
+        response.set_etag(etag)
+    elif request.method != 'DELETE':
+        response.add_etag()
+    if location is not None:
+        response.headers['Location'] = location
+    return response
+
+def bulk_write(model):
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        body = body.get('ids' if request.method == 'DELETE' else 'items')
+    if not isinstance(body, list) or len(body) == 0:
+        raise APIException("Send a non-empty JSON array", status_code=400)
+    if len(body) > app.config['BULK_MAX_ITEMS']:
+        raise APIException("A batch can not have more than %d items" % app.config['BULK_MAX_ITEMS'], status_code=413)
+
+    try:
+        if request.method == 'POST':
+            ids, errors = bulk_create(model, body)
+            result, status = {"created": len(body), "ids": ids}, 201
+        elif request.method == 'PATCH':
+            count, errors = bulk_update(model, body)
+            result, status = {"updated": count}, 200
+        else:
+            count, errors = bulk_delete(model, body)
+            result, status = {"deleted": count}, 200
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "the batch conflicts with existing data (is an item still in someone's favorites?)"}), 409
+
+    if errors:
+        return jsonify({"errors": errors}), 400
+    return jsonify(result), status
+
+FAVORITE_TYPES = tuple(TARGET_COLUMNS)
+
+def add_favorite(favorite_type, target_id):
+    # Adding a favorite twice is a no-op: 201 when created, 200 when it existed
+    user_id = get_jwt_identity()
+    try:
+        created = upsert_favorite(db.session, user_id, favorite_type, target_id)
+        db.session.commit()
+    except (IntegrityError, TargetNotFound):
+        db.session.rollback()
+        return jsonify({"error": "%s %d not found" % (favorite_type, target_id)}), 404
+
+    favorite = find_favorite(db.session, user_id, favorite_type, target_id)
+    if favorite is None:
+        # The target went away between the check and the insert (MySQL ignores it)
+        return jsonify({"error": "%s %d not found" % (favorite_type, target_id)}), 404
+    return write_response(favorite.serialize(), Favorites.query.filter_by(user_id=user_id),
+                          status=201 if created else 200)
+
+def delete_favorite(favorite_type, target_id):
+    user_id = get_jwt_identity()
+    favorite = find_favorite(db.session, user_id, favorite_type, target_id)
+    if favorite is None:
+        return jsonify({"error": "favorite not found"}), 404
+
+    deleted = favorite.serialize()
+    remove_favorite(db.session, user_id, favorite_type, target_id)
+    db.session.commit()
+    return write_response(deleted, Favorites.query.filter_by(user_id=user_id))
+
+#Export Endpoints
+
+EXPORTS = {"people": Characters, "planets": Planets, "vehicles": Vehicles, "favorites": Favorites}
+
+@app.route('/export/<string:collection>', methods=['GET'])
+@jwt_required()
+@use_replica
+def export_collection(collection):
+    if request.method == 'GET':
+        model = EXPORTS.get(collection)
+        if model is None:
+            return jsonify({"error": "unknown collection, use one of: " + ", ".join(EXPORTS)}), 404
+
+        # yield_per streams rows through a server-side cursor where the driver
+        # supports it, so memory stays flat however big the table is
+        statement = select(model).order_by(model.id).execution_options(yield_per=app.config['EXPORT_BATCH_SIZE'])
+        if model is Favorites:
+            # Like /users/favorites, only the favorites of the token user
+            statement = statement.where(Favorites.user_id == get_jwt_identity())
+
+        def generate():
+            for item in db.session.scalars(statement):
+                yield encode_row(item.serialize()) + b"\n"
+
+        return app.response_class(stream_with_context(generate()), mimetype="application/x-ndjson")
+    
+    return "Invalid Method", 404
+
+#Internal Endpoints
+
+@app.route('/internal/pool', methods=['GET'])
+@internal_only
+def get_pool_stats():
+    if request.method == 'GET':
+        return jsonify([stats.to_dict() for stats in pool_stats]), 200
+    
+    return "Invalid Method", 404
+
 #Login/Register Endpoints
 
 @app.route("/login", methods=["POST"])
 def login_user():
     username = request.json.get("username", None)
     password = request.json.get("password", None)
-    user = User.query.filter_by(username=username, password=password).first()
-    
-    if user is None :
+    if not isinstance(username, str) or not isinstance(password, str):
         return jsonify({"msg": "Wrong username or password"}), 401
 
-    access_token = create_access_token(identity=user.id)
-    return jsonify({ "token": access_token, "user_id": user.id })
+    retry_after = max(login_limiter_ip.hit(request.remote_addr), login_limiter_user.hit(username))
+    if retry_after:
+        return jsonify({"msg": "Too many login attempts, try again later"}), 429, {"Retry-After": str(retry_after)}
+
+    user = User.query.filter_by(username=username).first()
+    stored = user.password if user else None
+    user_id = user.id if user else None
+    claims = user_claims(user) if user else None
+    is_active = user.is_active if user else None
+    # Give the connection back before waiting for the hash pool, so a burst of
+    # logins does not hold the database pool while the hashes queue up
+    db.session.close()
+
+    valid, needs_rehash = password_hasher.verify(stored, password)
+    if not valid:
+        return jsonify({"msg": "Wrong username or password"}), 401
+    if is_active is False:
+        return jsonify({"msg": "This account is disabled"}), 403
+
+    if needs_rehash:
+        # Plaintext rows and hashes made with an older work factor get upgraded
+        password_hash = password_hasher.hash(password)
+        db.session.execute(update(User).where(User.id == user_id, User.password == stored).values(password=password_hash))
+        db.session.commit()
+
+    access_token = create_access_token(identity=user_id, additional_claims=claims)
+    return jsonify({ "token": access_token, "user_id": user_id })
+
+@app.route("/logout", methods=["POST"])
+@jwt_required()
+def logout_user():
+    app.extensions['jwt_revocations'].revoke_token(get_jwt()["jti"])
+    db.session.commit()
+    return jsonify({"msg": "Token revoked"}), 200
 
 @app.route('/register', methods=['POST'])
 def register_new_user():
@@ -66,17 +483,12 @@ def register_new_user():
         user.firstname = request.get_json()['firstname']
         user.lastname = request.get_json()['lastname']
         user.email = request.get_json()['email']
-        user.password = request.get_json()['password']
+        user.password = password_hasher.hash(request.get_json()['password'])
 
         db.session.add(user)
         db.session.commit()
 
-        # Show the updated version of the favorites
-        users = []
-        db_result = User.query.all()
-        for item in db_result:
-            users.append(item.serialize())
-        return jsonify(users), 200
+        return write_response(user.serialize(), User.query, status=201)
     
     return "Error Ocurred. Remember to add a username, firstname, lastname, email and password!", 404
 
@@ -97,13 +509,160 @@ def get_users():
 
 @app.route('/users/favorites', methods=['GET'])
 @jwt_required()
+@use_replica
 def get_user_favorites():
     if request.method == 'GET':
-        favorites = []
-        db_result = Favorites.query.all()
-        for item in db_result:
-            favorites.append(item.serialize())
-        return jsonify(favorites), 200
+        # Only the favorites of the user in the token, optionally narrowed with
+        # ?type= and with ?embed=true to inline the referenced entities
+        query = Favorites.query.filter_by(user_id=get_jwt_identity())
+        favorite_type = request.args.get('type')
+        if favorite_type:
+            favorite_type = TYPE_ALIASES.get(favorite_type, favorite_type)
+            if favorite_type not in FAVORITE_TYPES:
+                raise APIException("'type' must be one of: people, " + ", ".join(FAVORITE_TYPES), status_code=400)
+            query = query.filter_by(type=favorite_type)
+
+        embed = request.args.get('embed', '').lower() in ('1', 'true', 'yes')
+        if embed:
+            # One query with outer joins instead of one request per favorite
+            query = query.options(joinedload(Favorites.character), joinedload(Favorites.planet), joinedload(Favorites.vehicle))
+
+        def serialize(item):
+            result = item.serialize()
+            if embed:
+                target = item.target()
+                result[item.type[:-1]] = target.serialize() if target is not None else None
+            return result
+
+        if not wants_pagination(request.args):
+            return jsonify([serialize(item) for item in query.order_by(Favorites.id).all()]), 200
+
+        items, next_cursor, next_offset = paginate(
+            query, Favorites, request.args,
+            default_limit=app.config['PAGINATION_DEFAULT_LIMIT'],
+            max_limit=app.config['PAGINATION_MAX_LIMIT'],
+            max_offset=app.config['PAGINATION_MAX_OFFSET'],
+        )
+        result = {"results": [serialize(item) for item in items]}
+        if request.args.get("offset"):
+            result["next_offset"] = next_offset
+        else:
+            result["next"] = next_cursor
+        return jsonify(result), 200
+    
+    return "Invalid Method", 404
+
+@app.route('/favorites/top', methods=['GET'])
+@jwt_required()
+@use_replica
+def get_top_favorites():
+    if request.method == 'GET':
+        favorite_type = request.args.get('type', '')
+        favorite_type = TYPE_ALIASES.get(favorite_type, favorite_type)
+        if favorite_type not in TARGET_COLUMNS:
+            raise APIException("'type' must be one of: people, " + ", ".join(TARGET_COLUMNS), status_code=400)
+        limit = parse_int_arg(request.args, 'limit', 10, minimum=1, maximum=100)
+
+        # Counters are kept up to date by the favorite handlers, so this is a
+        # short index scan plus one lookup of at most `limit` rows
+        top = top_targets(db.session, favorite_type, limit)
+        model = CATALOG_TYPES[favorite_type]
+        items = {item.id: item for item in model.query.filter(model.id.in_([target_id for target_id, count in top]))}
+        return jsonify([
+            {"count": count, favorite_type[:-1]: items[target_id].serialize()}
+            for target_id, count in top if target_id in items
+        ]), 200
+    
+    return "Invalid Method", 404
+
+@app.route('/favorites/batch', methods=['POST'])
+@jwt_required()
+def batch_favorites():
+    if request.method == 'POST':
+        # [{"type": "planets", "id": 3, "action": "add"}, ...] applied in one
+        # transaction, answered with the resulting favorites of the user
+        operations = request.get_json(silent=True)
+        if isinstance(operations, dict):
+            operations = operations.get('operations')
+        if not isinstance(operations, list) or len(operations) == 0:
+            raise APIException("Send a non-empty JSON array of operations", status_code=400)
+        if len(operations) > app.config['FAVORITES_BATCH_MAX']:
+            raise APIException("A batch can not have more than %d operations" % app.config['FAVORITES_BATCH_MAX'], status_code=413)
+
+        errors = validate_operations(operations)
+        if errors:
+            return jsonify({"errors": errors}), 400
+
+        user_id = get_jwt_identity()
+        try:
+            apply_operations(db.session, user_id, operations)
+            db.session.commit()
+        except (IntegrityError, TargetNotFound):
+            db.session.rollback()
+            return jsonify({"error": "the batch references a character, planet or vehicle that does not exist"}), 404
+
+        favorites = Favorites.query.filter_by(user_id=user_id).order_by(Favorites.id).all()
+        return jsonify([item.serialize() for item in favorites]), 200
+    
+    return "Invalid Method", 404
+
+#Search Endpoints
+
+@app.route('/search', methods=['GET'])
+@jwt_required()
+@use_replica
+def search_catalog():
+    if request.method == 'GET':
+        # Ranked matches of every word of ?q= in the name or description,
+        # optionally limited to one ?type=, paged with ?limit= and ?offset=
+        query = request.args.get('q', '').strip()
+        if not query or len(query) > 200 or not any(character.isalnum() for character in query):
+            raise APIException("'q' must contain between 1 and 200 characters, including a word", status_code=400)
+        search_type = request.args.get('type')
+        if search_type:
+            search_type = TYPE_ALIASES.get(search_type, search_type)
+            if search_type not in CATALOG_TYPES:
+                raise APIException("'type' must be one of: people, " + ", ".join(CATALOG_TYPES), status_code=400)
+            types = [search_type]
+        else:
+            types = list(CATALOG_TYPES)
+
+        limit = parse_int_arg(request.args, 'limit', 20, minimum=1, maximum=100)
+        offset = parse_int_arg(request.args, 'offset', 0)
+        if offset + limit > app.config['PAGINATION_MAX_OFFSET']:
+            raise APIException("Search results are limited to the first %d matches" % app.config['PAGINATION_MAX_OFFSET'], status_code=400)
+
+        # One extra hit tells whether there is a next page
+        hits = catalog_search.search(db.session, query, types, limit + 1, offset)
+        results = [
+            {"type": name, "rank": float(rank), name[:-1]: item.serialize()}
+            for name, item, rank in load_results(db.session, hits[:limit])
+        ]
+        return jsonify({"results": results, "next_offset": offset + limit if len(hits) > limit else None}), 200
+    
+    return "Invalid Method", 404
+
+@app.route('/autocomplete', methods=['GET'])
+@jwt_required()
+def autocomplete_names():
+    if request.method == 'GET':
+        # Names starting with ?prefix= (or with a word starting with it),
+        # served from memory: see autocomplete.py
+        prefix = request.args.get('prefix', '').strip()
+        if not prefix or len(prefix) > 100:
+            raise APIException("'prefix' must contain between 1 and 100 characters", status_code=400)
+        autocomplete_type = request.args.get('type')
+        if autocomplete_type:
+            autocomplete_type = TYPE_ALIASES.get(autocomplete_type, autocomplete_type)
+            if autocomplete_type not in CATALOG_TYPES:
+                raise APIException("'type' must be one of: people, " + ", ".join(CATALOG_TYPES), status_code=400)
+            types = [autocomplete_type]
+        else:
+            types = list(CATALOG_TYPES)
+        limit = parse_int_arg(request.args, 'limit', 10, minimum=1, maximum=50)
+
+        results = autocomplete_index.lookup(db.session, prefix, types, limit)
+        return jsonify([{"type": name, "id": item_id, "name": item_name} for name, item_id, item_name in results]), 200
     
     return "Invalid Method", 404
 
@@ -111,25 +670,19 @@ def get_user_favorites():
 
 @app.route('/people', methods=['GET'])
 @jwt_required()
+@use_replica
 def get_people():
     if request.method == 'GET':
-        people = []
-        db_result = Characters.query.all()
-        for item in db_result:
-            people.append(item.serialize())
-        return jsonify(people), 200
+        return list_response(Characters)
     
     return "Invalid Method", 404
 
 @app.route('/people/<int:char_id>', methods=['GET'])
 @jwt_required()
+@use_replica
 def get_people_id(char_id):
     if request.method == 'GET':
-        people = []
-        db_result = Characters.query.filter_by(id=char_id).all()
-        for item in db_result:
-            people.append(item.serialize())
-        return jsonify(people), 200
+        return item_response(Characters, char_id)
     
     return "Invalid Method", 404
 
@@ -149,12 +702,9 @@ def add_new_character():
         db.session.add(people)
         db.session.commit()
 
-        # Show the updated version of the characters
-        characters = []
-        db_result = Characters.query.all()
-        for item in db_result:
-            characters.append(item.serialize())
-        return jsonify(characters), 200
+        return write_response(people.serialize(), Characters.query, status=201,
+                              location=url_for('get_people_id', char_id=people.id),
+                              etag=resource_etag(Characters, people.id, people.revision))
     
     return "An error has ocurred!", 404
 
@@ -177,12 +727,8 @@ def update_character(char_id):
 
         db.session.commit()
 
-        # Show the updated version of the characters
-        characters = []
-        db_result = Characters.query.all()
-        for item in db_result:
-            characters.append(item.serialize())
-        return jsonify(characters), 200
+        return write_response(people.serialize(), Characters.query,
+                              etag=resource_etag(Characters, people.id, people.revision))
     
     return "An error has ocurred!", 404
 
@@ -192,36 +738,27 @@ def delete_character(char_id):
     if request.method == 'DELETE':
         character = Characters.query.filter_by(id=char_id).first()
 
+        if character is None:
+            return jsonify({"error": "character not found"}), 404
+
+        deleted = character.serialize()
         db.session.delete(character)
         db.session.commit()
 
-        # Show the updated version of the characters
-        characters = []
-        db_result = Characters.query.all()
-        for item in db_result:
-            characters.append(item.serialize())
-        return jsonify(characters), 200
+        return write_response(deleted, Characters.query)
     
     return "Invalid Method", 404
 
+@app.route('/people/bulk', methods=['POST', 'PATCH', 'DELETE'])
+@jwt_required()
+def bulk_people():
+    return bulk_write(Characters)
+
 @app.route('/favorites/people/<int:char_id>', methods=['POST'])
 @jwt_required()
 def add_new_favorite_character(char_id):
     if request.method == 'POST':
-        favorite = Favorites()
-        favorite.user_id = get_jwt_identity()
-        favorite.char_id = char_id
-        favorite.type = 'characters'
-
-        db.session.add(favorite)
-        db.session.commit()
-
-        # Show the updated version of the favorites
-        favorites = []
-        db_result = Favorites.query.filter_by(user_id=get_jwt_identity())
-        for item in db_result:
-            favorites.append(item.serialize())
-        return jsonify(favorites), 200
+        return add_favorite('characters', char_id)
     
     return "Invalid Method", 404
 
@@ -229,17 +766,7 @@ def add_new_favorite_character(char_id):
 @jwt_required()
 def delete_favorite_character(char_id):
     if request.method == 'DELETE':
-        favorite = Favorites.query.filter_by(char_id=char_id, user_id=get_jwt_identity(), type='characters').first()
-
-        db.session.delete(favorite)
-        db.session.commit()
-
-        # Show the updated version of the favorites
-        favorites = []
-        db_result = Favorites.query.filter_by(user_id=get_jwt_identity())
-        for item in db_result:
-            favorites.append(item.serialize())
-        return jsonify(favorites), 200
+        return delete_favorite('characters', char_id)
     
     return "Invalid Method", 404
 
@@ -248,25 +775,19 @@ def delete_favorite_character(char_id):
 
 @app.route('/planets', methods=['GET'])
 @jwt_required()
+@use_replica
 def get_planets():
     if request.method == 'GET':
-        planets = []
-        db_result = Planets.query.all()
-        for item in db_result:
-            planets.append(item.serialize())
-        return jsonify(planets), 200
+        return list_response(Planets)
     
     return "Invalid Method", 404
 
 @app.route('/planets/<int:planet_id>', methods=['GET'])
 @jwt_required()
+@use_replica
 def get_planets_id(planet_id):
     if request.method == 'GET':
-        planets = []
-        db_result = Planets.query.filter_by(id=planet_id).all()
-        for item in db_result:
-            planets.append(item.serialize())
-        return jsonify(planets), 200
+        return item_response(Planets, planet_id)
     
     return "Invalid Method", 404
 
@@ -287,12 +808,9 @@ def add_new_planet():
         db.session.add(planet)
         db.session.commit()
 
-        # Show the updated version of the favorites
-        planets = []
-        db_result = Planets.query.all()
-        for item in db_result:
-            planets.append(item.serialize())
-        return jsonify(planets), 200
+        return write_response(planet.serialize(), Planets.query, status=201,
+                              location=url_for('get_planets_id', planet_id=planet.id),
+                              etag=resource_etag(Planets, planet.id, planet.revision))
     
     return "An error has ocurred!", 404
 
@@ -316,12 +834,8 @@ def update_planet(planet_id):
 
         db.session.commit()
 
-        # Show the updated version of the planets
-        planets = []
-        db_result = Planets.query.all()
-        for item in db_result:
-            planets.append(item.serialize())
-        return jsonify(planets), 200
+        return write_response(planet.serialize(), Planets.query,
+                              etag=resource_etag(Planets, planet.id, planet.revision))
     
     return "An error has ocurred!", 404
 
@@ -331,36 +845,27 @@ def delete_planet(planet_id):
     if request.method == 'DELETE':
         planet = Planets.query.filter_by(id=planet_id).first()
 
+        if planet is None:
+            return jsonify({"error": "planet not found"}), 404
+
+        deleted = planet.serialize()
         db.session.delete(planet)
         db.session.commit()
 
-        # Show the updated version of the planets
-        planets = []
-        db_result = Planets.query.all()
-        for item in db_result:
-            planets.append(item.serialize())
-        return jsonify(planets), 200
+        return write_response(deleted, Planets.query)
     
     return "Invalid Method", 404
 
+@app.route('/planets/bulk', methods=['POST', 'PATCH', 'DELETE'])
+@jwt_required()
+def bulk_planets():
+    return bulk_write(Planets)
+
 @app.route('/favorites/planets/<int:planet_id>', methods=['POST'])
 @jwt_required()
 def add_new_favorite_planet(planet_id):
     if request.method == 'POST':
-        favorite = Favorites()
-        favorite.user_id = get_jwt_identity()
-        favorite.planet_id = planet_id
-        favorite.type = 'planets'
-
-        db.session.add(favorite)
-        db.session.commit()
-
-        # Show the updated version of the favorites
-        favorites = []
-        db_result = Favorites.query.filter_by(user_id=get_jwt_identity())
-        for item in db_result:
-            favorites.append(item.serialize())
-        return jsonify(favorites), 200
+        return add_favorite('planets', planet_id)
     
     return "Invalid Method", 404
 
@@ -368,17 +873,7 @@ def add_new_favorite_planet(planet_id):
 @jwt_required()
 def delete_favorite_planet(planet_id):
     if request.method == 'DELETE':
-        favorite = Favorites.query.filter_by(planet_id=planet_id, user_id=get_jwt_identity(), type='planets').first()
-
-        db.session.delete(favorite)
-        db.session.commit()
-
-        # Show the updated version of the favorites
-        favorites = []
-        db_result = Favorites.query.filter_by(user_id=get_jwt_identity())
-        for item in db_result:
-            favorites.append(item.serialize())
-        return jsonify(favorites), 200
+        return delete_favorite('planets', planet_id)
     
     return "Invalid Method", 404
 
@@ -387,25 +882,19 @@ def delete_favorite_planet(planet_id):
 
 @app.route('/vehicles', methods=['GET'])
 @jwt_required()
+@use_replica
 def get_vehicles():
     if request.method == 'GET':
-        vehicles = []
-        db_result = Vehicles.query.all()
-        for item in db_result:
-            vehicles.append(item.serialize())
-        return jsonify(vehicles), 200
+        return list_response(Vehicles)
     
     return "Invalid Method", 404
 
 @app.route('/vehicles/<int:vehicle_id>', methods=['GET'])
 @jwt_required()
+@use_replica
 def get_vehicles_id(vehicle_id):
     if request.method == 'GET':
-        vehicles = []
-        db_result = Vehicles.query.filter_by(id=vehicle_id).all()
-        for item in db_result:
-            vehicles.append(item.serialize())
-        return jsonify(vehicles), 200
+        return item_response(Vehicles, vehicle_id)
     
     return "Invalid Method", 404
 
@@ -426,12 +915,9 @@ def add_new_vehicle():
         db.session.add(vehicle)
         db.session.commit()
 
-        # Show the updated version of the favorites
-        vehicles = []
-        db_result = Vehicles.query.all()
-        for item in db_result:
-            vehicles.append(item.serialize())
-        return jsonify(vehicles), 200
+        return write_response(vehicle.serialize(), Vehicles.query, status=201,
+                              location=url_for('get_vehicles_id', vehicle_id=vehicle.id),
+                              etag=resource_etag(Vehicles, vehicle.id, vehicle.revision))
     
     return "An error has ocurred!", 404
 
@@ -455,12 +941,8 @@ def update_vehicle(vehicle_id):
 
         db.session.commit()
 
-        # Show the updated version of the vehicles
-        vehicles = []
-        db_result = Vehicles.query.all()
-        for item in db_result:
-            vehicles.append(item.serialize())
-        return jsonify(vehicles), 200
+        return write_response(vehicle.serialize(), Vehicles.query,
+                              etag=resource_etag(Vehicles, vehicle.id, vehicle.revision))
     
     return "An error has ocurred!", 404
 
@@ -470,36 +952,27 @@ def delete_vehicle(vehicle_id):
     if request.method == 'DELETE':
         vehicle = Vehicles.query.filter_by(id=vehicle_id).first()
 
+        if vehicle is None:
+            return jsonify({"error": "vehicle not found"}), 404
+
+        deleted = vehicle.serialize()
         db.session.delete(vehicle)
         db.session.commit()
 
-        # Show the updated version of the vehicles
-        vehicles = []
-        db_result = Vehicles.query.all()
-        for item in db_result:
-            vehicles.append(item.serialize())
-        return jsonify(vehicles), 200
+        return write_response(deleted, Vehicles.query)
     
     return "Invalid Method", 404
 
+@app.route('/vehicles/bulk', methods=['POST', 'PATCH', 'DELETE'])
+@jwt_required()
+def bulk_vehicles():
+    return bulk_write(Vehicles)
+
 @app.route('/favorites/vehicles/<int:vehicle_id>', methods=['POST'])
 @jwt_required()
 def add_new_favorite_vehicle(vehicle_id):
     if request.method == 'POST':
-        favorite = Favorites()
-        favorite.user_id = get_jwt_identity()
-        favorite.vehicle_id = vehicle_id
-        favorite.type = 'vehicles'
-
-        db.session.add(favorite)
-        db.session.commit()
-
-        # Show the updated version of the favorites
-        favorites = []
-        db_result = Favorites.query.filter_by(user_id=get_jwt_identity())
-        for item in db_result:
-            favorites.append(item.serialize())
-        return jsonify(favorites), 200
+        return add_favorite('vehicles', vehicle_id)
     
     return "Invalid Method", 404
 
@@ -507,17 +980,7 @@ def add_new_favorite_vehicle(vehicle_id):
 @jwt_required()
 def delete_favorite_vehicle(vehicle_id):
     if request.method == 'DELETE':
-        favorite = Favorites.query.filter_by(vehicle_id=vehicle_id, user_id=get_jwt_identity(), type='vehicles').first()
-
-        db.session.delete(favorite)
-        db.session.commit()
-
-        # Show the updated version of the favorites
-        favorites = []
-        db_result = Favorites.query.filter_by(user_id=get_jwt_identity())
-        for item in db_result:
-            favorites.append(item.serialize())
-        return jsonify(favorites), 200
+        return delete_favorite('vehicles', vehicle_id)
     
     return "Invalid Method", 404
 
@@ -0,0 +1,316 @@
+"""
+ASGI entry point: the catalog and favorites GET routes run as coroutines on an
+async SQLAlchemy engine, every other route is the regular Flask app running in
+a thread pool. Responses are built with the same helpers, error handlers and
+after_request hooks as the WSGI app, so clients can not tell the two apart.
+
+The packages it needs (uvicorn, asgiref and the async drivers) are in the
+Pipfile:
+
+    $ gunicorn asgi:application --chdir ./src/ -k uvicorn.workers.UvicornWorker
+
+This is not a throughput win everywhere: with benchmarks/serving.py on a
+local SQLite file the uvicorn workers serve about 200 req/s against about
+295 for the sync workers, since aiosqlite runs every query on a thread. The
+async mode only pays off when the database is across a network and the
+workers would otherwise sit waiting on round trips; measure it with the same
+script against that database before switching.
+
+Read replicas are not used in this mode, and with CACHE_BACKEND=redis the
+cache calls are still blocking ones.
+"""
+import asyncio
+import io
+from datetime import datetime
+from flask import request, jsonify
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import joinedload
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+from app import app, entity_cache, snapshots, entity_key, resource_etag, collection_etag
+from app import not_modified, set_validators, is_conditional, FAVORITE_TYPES
+from database import engine_options
+from favorites import TARGET_COLUMNS, TYPE_ALIASES, top_targets
+from models import Favorites, Characters, Planets, Vehicles, CollectionRevision, CATALOG_TYPES
+from utils import APIException, wants_pagination, wants_filtering, apply_filters, parse_sort, sort_order
+from utils import parse_fields, load_fields, serialize_fields, parse_int_arg, page_query, page_results
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql',
+}
+
+def async_database_url(url):
+    backend, rest = url.split(":", 1)
+    backend = backend.split("+", 1)[0]
+    return ASYNC_DRIVERS.get(backend, backend) + ":" + rest
+
+def async_engine_options(url):
+    options = engine_options(url)
+    connect_args = options.get("connect_args", {})
+    if "options" in connect_args:
+        # asyncpg takes server settings instead of a libpq options string
+        timeout = connect_args.pop("options").split("=", 1)[1]
+        connect_args["server_settings"] = {"statement_timeout": timeout}
+    return options
+
+database_url = async_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+engine = create_async_engine(database_url, **async_engine_options(database_url))
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+# Same logic as the handlers in app.py, awaiting the queries instead
+
+async def load_entity(session, model, item_id, revision=None):
+    key = entity_key(model.__tablename__, item_id)
+    entry = entity_cache.get(key)
+    if entry is not None and (revision is None or entry["revision"] == revision):
+        return entry
+
+    item = await session.get(model, item_id)
+    if item is None:
+        return None
+    entry = {
+        "data": item.serialize(),
+        "revision": item.revision,
+        "updated_at": item.updated_at.isoformat(),
+    }
+    entity_cache.set(key, entry)
+    return entry
+
+async def item_response(session, model, item_id):
+    fields = parse_fields(model, request.args)
+    key = entity_key(model.__tablename__, item_id)
+    revision = None
+    if app.config['CACHE_VERIFY'] or is_conditional() and entity_cache.get(key) is None:
+        version = (await session.execute(select(model.revision, model.updated_at).where(model.id == item_id))).first()
+        if version is None:
+            return jsonify([])
+        cached = not_modified(resource_etag(model, item_id, version.revision, fields), version.updated_at)
+        if cached is not None:
+            return cached
+        revision = version.revision
+
+    entry = await load_entity(session, model, item_id, revision)
+    if entry is None:
+        return jsonify([])
+
+    etag = resource_etag(model, item_id, entry["revision"], fields)
+    last_modified = datetime.fromisoformat(entry["updated_at"])
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        return cached
+    data = entry["data"] if fields is None else {name: entry["data"][name] for name in fields}
+    return set_validators(jsonify([data]), etag, last_modified)
+
+async def list_response(session, model):
+    version = await session.get(CollectionRevision, model.__tablename__)
+    revision = version.revision if version else 0
+    etag = collection_etag(model, revision)
+    last_modified = version.updated_at if version else None
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        return cached
+
+    return set_validators(await build_list_response(session, model, revision), etag, last_modified)
+
+async def build_list_response(session, model, revision):
+    filtered = wants_filtering(model, request.args)
+    fields = parse_fields(model, request.args)
+    sort = parse_sort(model, request.args)
+    query = apply_filters(select(model), model, request.args)
+    if fields is None:
+        serialize = model.serialize
+    else:
+        query = load_fields(query, model, fields, sort)
+        serialize = lambda item: serialize_fields(item, fields)
+
+    if not wants_pagination(request.args):
+        if not filtered and fields is None:
+            # The snapshot is shared with the sync handlers and syncs itself
+            # through a sync facade of this session
+            body = await session.run_sync(snapshots[model].get, revision)
+            response = app.response_class(body, mimetype=app.json.mimetype)
+            response.compressed_variants = snapshots[model].variants(body)
+            return response
+        items = (await session.scalars(query.order_by(*sort_order(model, sort)))).all()
+        return jsonify([serialize(item) for item in items])
+
+    query, limit, offset = page_query(
+        query, model, request.args, sort=sort,
+        default_limit=app.config['PAGINATION_DEFAULT_LIMIT'],
+        max_limit=app.config['PAGINATION_MAX_LIMIT'],
+        max_offset=app.config['PAGINATION_MAX_OFFSET'],
+    )
+    items, next_cursor, next_offset = page_results((await session.scalars(query)).all(), sort, limit, offset)
+    result = {"results": [serialize(item) for item in items]}
+    if request.args.get("offset"):
+        result["next_offset"] = next_offset
+    else:
+        result["next"] = next_cursor
+    return jsonify(result)
+
+async def get_user_favorites(session):
+    query = select(Favorites).filter_by(user_id=get_jwt_identity())
+    favorite_type = request.args.get('type')
+    if favorite_type:
+        favorite_type = TYPE_ALIASES.get(favorite_type, favorite_type)
+        if favorite_type not in FAVORITE_TYPES:
+            raise APIException("'type' must be one of: people, " + ", ".join(FAVORITE_TYPES), status_code=400)
+        query = query.filter_by(type=favorite_type)
+
+    embed = request.args.get('embed', '').lower() in ('1', 'true', 'yes')
+    if embed:
+        query = query.options(joinedload(Favorites.character), joinedload(Favorites.planet), joinedload(Favorites.vehicle))
+
+    def serialize(item):
+        result = item.serialize()
+        if embed:
+            target = item.target()
+            result[item.type[:-1]] = target.serialize() if target is not None else None
+        return result
+
+    if not wants_pagination(request.args):
+        items = (await session.scalars(query.order_by(Favorites.id))).all()
+        return jsonify([serialize(item) for item in items]), 200
+
+    query, limit, offset = page_query(
+        query, Favorites, request.args,
+        default_limit=app.config['PAGINATION_DEFAULT_LIMIT'],
+        max_limit=app.config['PAGINATION_MAX_LIMIT'],
+        max_offset=app.config['PAGINATION_MAX_OFFSET'],
+    )
+    items, next_cursor, next_offset = page_results((await session.scalars(query)).all(), ("id", False), limit, offset)
+    result = {"results": [serialize(item) for item in items]}
+    if request.args.get("offset"):
+        result["next_offset"] = next_offset
+    else:
+        result["next"] = next_cursor
+    return jsonify(result), 200
+
+async def get_top_favorites(session):
+    favorite_type = request.args.get('type', '')
+    favorite_type = TYPE_ALIASES.get(favorite_type, favorite_type)
+    if favorite_type not in TARGET_COLUMNS:
+        raise APIException("'type' must be one of: people, " + ", ".join(TARGET_COLUMNS), status_code=400)
+    limit = parse_int_arg(request.args, 'limit', 10, minimum=1, maximum=100)
+
+    top = await session.run_sync(top_targets, favorite_type, limit)
+    model = CATALOG_TYPES[favorite_type]
+    items = {item.id: item for item in await session.scalars(select(model).where(model.id.in_([target_id for target_id, count in top])))}
+    return jsonify([
+        {"count": count, favorite_type[:-1]: items[target_id].serialize()}
+        for target_id, count in top if target_id in items
+    ]), 200
+
+HANDLERS = {
+    'people': lambda session: list_response(session, Characters),
+    'people_id': lambda session, item_id: item_response(session, Characters, item_id),
+    'planets': lambda session: list_response(session, Planets),
+    'planets_id': lambda session, item_id: item_response(session, Planets, item_id),
+    'vehicles': lambda session: list_response(session, Vehicles),
+    'vehicles_id': lambda session, item_id: item_response(session, Vehicles, item_id),
+    'user_favorites': get_user_favorites,
+    'top_favorites': get_top_favorites,
+}
+
+url_map = Map([
+    Rule('/people', endpoint='people'),
+    Rule('/people/<int:item_id>', endpoint='people_id'),
+    Rule('/planets', endpoint='planets'),
+    Rule('/planets/<int:item_id>', endpoint='planets_id'),
+    Rule('/vehicles', endpoint='vehicles'),
+    Rule('/vehicles/<int:item_id>', endpoint='vehicles_id'),
+    Rule('/users/favorites', endpoint='user_favorites'),
+    Rule('/favorites/top', endpoint='top_favorites'),
+], strict_slashes=False)
+
+def build_environ(scope):
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_PROTOCOL": "HTTP/%s" % scope["http_version"],
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(b""),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("server"):
+        environ["SERVER_NAME"], environ["SERVER_PORT"] = scope["server"][0], str(scope["server"][1])
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        value = value.decode("latin-1")
+        environ[name] = environ[name] + "," + value if name in environ else value
+    return environ
+
+async def authenticate():
+    # Off the event loop in every mode: besides the identity lookup ("cache"
+    # and "db"), the revocation check reads the token_revocations table
+    await asyncio.to_thread(verify_jwt_in_request)
+
+async def dispatch(endpoint, arguments, environ):
+    with app.request_context(environ):
+        try:
+            response = app.preprocess_request()
+            if response is None:
+                await authenticate()
+                async with Session() as session:
+                    response = await HANDLERS[endpoint](session, **arguments)
+            response = app.make_response(response)
+        except Exception as error:
+            try:
+                response = app.make_response(app.handle_user_exception(error))
+            except Exception as error:
+                response = app.handle_exception(error)
+        return app.process_response(response)
+
+class AsyncAPI:
+    def __init__(self):
+        self.wsgi = WsgiToAsgi(app)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "http" and scope["method"] == "GET":
+            environ = build_environ(scope)
+            try:
+                endpoint, arguments = url_map.bind_to_environ(environ).match()
+            except HTTPException:
+                endpoint = None
+            if endpoint is not None:
+                response = await dispatch(endpoint, arguments, environ)
+                await send({
+                    "type": "http.response.start",
+                    "status": response.status_code,
+                    "headers": [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                for name, value in response.headers.to_wsgi_list()],
+                })
+                await send({"type": "http.response.body", "body": response.get_data()})
+                return
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+application = AsyncAPI()
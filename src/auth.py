@@ -0,0 +1,260 @@
+"""
+Password hashing, login throttling and the JWT identity checks.
+
+Hashing is deliberately slow, so it runs on a small dedicated thread pool:
+hashlib releases the GIL while it works, the request thread just waits for
+the result, and a burst of logins can never occupy more than
+AUTH_HASH_WORKERS cores of a worker. That only leaves room for other requests
+when the worker has other threads to serve them (gthread with
+GUNICORN_THREADS > 1, or the ASGI workers); a sync worker handles one request
+at a time and is busy for the whole login either way.
+"""
+import hmac
+import threading
+import time
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import current_app, jsonify, request
+from sqlalchemy import event, delete, insert, select
+from werkzeug.security import generate_password_hash, check_password_hash
+from cache import make_cache, NullCache
+from models import db, User, TokenRevocation
+
+HASH_PREFIXES = ('pbkdf2:', 'scrypt:')
+
+class HashingBusy(Exception):
+    """The hash pool did not get to a password within the timeout."""
+
+class PasswordHasher:
+    def __init__(self, method="pbkdf2:sha256:600000", workers=2, timeout=10):
+        self.method = method
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        # Compared against when the user does not exist, so a wrong username
+        # takes as long as a wrong password
+        self._dummy_hash = generate_password_hash("not a real password", method=method)
+
+    def _run(self, function, *args):
+        future = self._executor.submit(function, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Still queued: drop it instead of hashing for a client that is gone
+            future.cancel()
+            raise HashingBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, stored, password):
+        """Return (valid, needs_rehash) for a stored hash or legacy plaintext value."""
+        if stored is None:
+            self._run(check_password_hash, self._dummy_hash, password)
+            return False, False
+        if not stored.startswith(HASH_PREFIXES):
+            # Rows written before passwords were hashed: accept once, then upgrade
+            return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8")), True
+        valid = self._run(check_password_hash, stored, password)
+        return valid, valid and not stored.startswith(self.method + "$")
+
+class RateLimiter:
+    """Fixed-window counter per key, kept in the memory of each worker."""
+
+    def __init__(self, limit, window=60, max_keys=100000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """Count one attempt; return the seconds to wait if over the limit, else 0."""
+        now = time.monotonic()
+        with self._lock:
+            started, count = self._hits.get(key, (now, 0))
+            if now - started >= self.window:
+                started, count = now, 0
+            count += 1
+            self._hits[key] = (started, count)
+            if len(self._hits) > self.max_keys:
+                self._prune(now)
+            if count > self.limit:
+                return int(self.window - (now - started)) + 1
+            return 0
+
+    def _prune(self, now):
+        for key in [key for key, (started, count) in self._hits.items() if now - started >= self.window]:
+            del self._hits[key]
+
+# JWT identity checks. Tokens carry the claims handlers need (is_active), so
+# by default (JWT_USER_CHECK=claims) authorization costs no query at all.
+# "cache" additionally loads the user through a TTL cache, so a deactivated
+# user is locked out within JWT_IDENTITY_CACHE_TTL seconds, and "db" loads
+# the user on every request. Revoked tokens and users are always rejected:
+# revocations live in Redis with CACHE_BACKEND=redis, otherwise in the
+# token_revocations table, which every worker mirrors in memory and re-reads
+# at most every JWT_REVOCATION_SYNC_SECONDS.
+
+def user_claims(user):
+    return {"is_active": user.is_active is not False}
+
+class TokenRevocations:
+    def __init__(self, cache):
+        self.cache = cache
+
+    def revoke_token(self, jti, connection=None):
+        self.cache.set("jti:" + jti, True)
+
+    def revoke_user(self, user_id, connection=None):
+        # Every token of the user issued up to now stops working
+        self.cache.set("user:%s" % user_id, time.time())
+
+    def is_revoked(self, payload):
+        if self.cache.get("jti:" + payload["jti"]):
+            return True
+        revoked_at = self.cache.get("user:%s" % payload["sub"])
+        return revoked_at is not None and payload.get("iat", 0) <= revoked_at
+
+class DatabaseRevocations:
+    """Revocations shared through the token_revocations table.
+
+    Checks are answered from an in-memory copy. The rows added since the last
+    read are fetched at most every sync_interval seconds (0: on every check),
+    so a logout or deactivation on one worker reaches the others within that
+    window. The worker that revokes sees it immediately.
+
+    Reads and writes go through db.session, on the connection the request
+    uses anyway, and only one request at a time does the periodic read while
+    the others answer from the current copy.
+    """
+    # Rows are read back by revoked_at; transactions committing later than
+    # this after taking their timestamp would be missed
+    overlap = 60
+
+    def __init__(self, lifetime, sync_interval=1):
+        self.lifetime = lifetime
+        self.sync_interval = sync_interval
+        self.tokens = {}
+        self.users = {}
+        self.synced_at = None
+        self.read_from = 0.0
+        self._lock = threading.Lock()
+        self._syncing = threading.Lock()
+
+    def _remember(self, jti, user_id, revoked_at, expires_at):
+        with self._lock:
+            if jti is not None:
+                self.tokens[jti] = expires_at
+            else:
+                current = self.users.get(str(user_id))
+                if current is None or current[0] < revoked_at:
+                    self.users[str(user_id)] = (revoked_at, expires_at)
+
+    def _revoke(self, connection, jti=None, user_id=None):
+        now = time.time()
+        # A token can not outlive its own lifetime; without one, keep a day
+        expires_at = now + (self.lifetime or 86400)
+        statement = insert(TokenRevocation).values(jti=jti, user_id=user_id, revoked_at=now, expires_at=expires_at)
+        if connection is None:
+            # Committed by the caller, with the rest of the request
+            db.session.execute(statement)
+            db.session.execute(delete(TokenRevocation).where(TokenRevocation.expires_at < now))
+        else:
+            connection.execute(statement)
+        self._remember(jti, user_id, now, expires_at)
+
+    def revoke_token(self, jti, connection=None):
+        self._revoke(connection, jti=jti)
+
+    def revoke_user(self, user_id, connection=None):
+        self._revoke(connection, user_id=user_id)
+
+    def sync(self, session):
+        now = time.time()
+        rows = session.execute(
+            select(TokenRevocation.jti, TokenRevocation.user_id, TokenRevocation.revoked_at, TokenRevocation.expires_at)
+            .where(TokenRevocation.revoked_at >= self.read_from, TokenRevocation.expires_at >= now)
+        ).all()
+        for row in rows:
+            self._remember(*row)
+        with self._lock:
+            self.tokens = {jti: expires_at for jti, expires_at in self.tokens.items() if expires_at >= now}
+            self.users = {user_id: entry for user_id, entry in self.users.items() if entry[1] >= now}
+        self.read_from = now - self.overlap
+        self.synced_at = time.monotonic()
+
+    def maybe_sync(self, session):
+        if self.synced_at is not None and time.monotonic() - self.synced_at < self.sync_interval:
+            return
+        if self.synced_at is None:
+            # Nothing may be answered before the first read
+            with self._syncing:
+                if self.synced_at is None:
+                    self.sync(session)
+        elif self._syncing.acquire(blocking=False):
+            try:
+                self.sync(session)
+            finally:
+                self._syncing.release()
+
+    def is_revoked(self, payload):
+        self.maybe_sync(db.session)
+        if payload["jti"] in self.tokens:
+            return True
+        entry = self.users.get(str(payload["sub"]))
+        return entry is not None and payload.get("iat", 0) <= entry[0]
+
+def setup_jwt(app, jwt):
+    mode = app.config['JWT_USER_CHECK']
+    expires = app.config.get('JWT_ACCESS_TOKEN_EXPIRES')
+    # Revocations only have to outlive the tokens they cancel
+    lifetime = int(expires.total_seconds()) if expires else 0
+    if app.config.get('CACHE_BACKEND') == 'redis':
+        revocations = TokenRevocations(make_cache(app.config, ttl=lifetime, prefix="starwars:revoked:"))
+    else:
+        # A per-process cache would only revoke on the worker that got the
+        # logout, so share them through the database
+        revocations = DatabaseRevocations(lifetime, app.config['JWT_REVOCATION_SYNC_SECONDS'])
+    identity_cache = make_cache(app.config, ttl=app.config['JWT_IDENTITY_CACHE_TTL'], prefix="starwars:identity:")
+    if mode == 'db':
+        identity_cache = NullCache()
+    app.extensions['jwt_revocations'] = revocations
+
+    @jwt.token_in_blocklist_loader
+    def check_if_token_revoked(jwt_header, jwt_payload):
+        return revocations.is_revoked(jwt_payload) or jwt_payload.get("is_active") is False
+
+    if mode in ('cache', 'db'):
+        @jwt.user_lookup_loader
+        def load_user(jwt_header, jwt_payload):
+            key = str(jwt_payload["sub"])
+            entry = identity_cache.get(key)
+            if entry is None:
+                user = db.session.get(User, jwt_payload["sub"])
+                entry = {"id": user.id, "is_active": user.is_active is not False} if user else {"id": None}
+                identity_cache.set(key, entry)
+            return entry if entry["id"] is not None and entry["is_active"] else None
+
+    # Deactivating a user (API or Flask-Admin) revokes their tokens right away
+    @event.listens_for(User, "after_update")
+    def forget_user(mapper, connection, target):
+        identity_cache.delete(str(target.id))
+        if target.is_active is False:
+            revocations.revoke_user(target.id, connection)
+
+    @event.listens_for(User, "after_delete")
+    def forget_deleted_user(mapper, connection, target):
+        identity_cache.delete(str(target.id))
+        revocations.revoke_user(target.id, connection)
+
+def internal_only(view):
+    """Operations endpoints: only answered when the X-Internal-Key header
+    matches INTERNAL_API_KEY, and hidden (404) otherwise or when it is unset."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = current_app.config.get('INTERNAL_API_KEY')
+        supplied = request.headers.get('X-Internal-Key', '')
+        if not key or not hmac.compare_digest(supplied.encode("utf-8"), key.encode("utf-8")):
+            return jsonify({"msg": "Not found"}), 404
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,184 @@
+"""
+Type-ahead over catalog names, answered from memory.
+
+Each collection keeps two sorted lists of (normalized key, id): one keyed by
+the whole name and one by every later word of it, so "sky" finds "Luke
+Skywalker" after the names starting with "sky". A lookup is two bisects and a
+short scan.
+
+The index is loaded on first use (or by gunicorn before forking the
+workers) and updated from the catalog change events of this worker: deletes
+right away, inserts and updates by reading the changed rows on the next
+lookup, through the session of that request. Writes
+that never reach this worker (other workers, `flask catalog import`) are
+picked up by comparing the collection revisions at most every
+refresh_interval seconds; only that comparison touches the database.
+"""
+import bisect
+import threading
+import time
+import unicodedata
+from sqlalchemy import select
+from models import CollectionRevision, CATALOG_TYPES
+
+
+def normalize(value):
+    # Case and accent insensitive: "Padmé" and "padme" share a key
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(character for character in decomposed if not unicodedata.combining(character)).casefold()
+
+def word_keys(key):
+    return [key[index:] for index in range(1, len(key)) if key[index - 1] == " " and key[index] != " "]
+
+class NameIndex:
+    def __init__(self):
+        self.names = []
+        self.words = []
+        # id -> (revision, name)
+        self.items = {}
+
+    def _entries(self, item_id, name):
+        key = normalize(name)
+        return (key, item_id), [(word, item_id) for word in word_keys(key)]
+
+    def add(self, item_id, revision, name):
+        if item_id in self.items:
+            self.remove(item_id)
+        entry, words = self._entries(item_id, name)
+        bisect.insort(self.names, entry)
+        for word in words:
+            bisect.insort(self.words, word)
+        self.items[item_id] = (revision, name)
+
+    def remove(self, item_id):
+        if item_id not in self.items:
+            return
+        revision, name = self.items.pop(item_id)
+        entry, words = self._entries(item_id, name)
+        for entries, value in [(self.names, entry)] + [(self.words, word) for word in words]:
+            index = bisect.bisect_left(entries, value)
+            if index < len(entries) and entries[index] == value:
+                del entries[index]
+
+    def load(self, rows):
+        """Replace the contents with (id, revision, name) rows in one go."""
+        self.items = {item_id: (revision, name) for item_id, revision, name in rows}
+        self.names, self.words = [], []
+        for item_id, (revision, name) in self.items.items():
+            entry, words = self._entries(item_id, name)
+            self.names.append(entry)
+            self.words.extend(words)
+        self.names.sort()
+        self.words.sort()
+
+    def lookup(self, prefix, limit):
+        found = []
+        for entries in (self.names, self.words):
+            index = bisect.bisect_left(entries, (prefix,))
+            while index < len(entries) and len(found) < limit and entries[index][0].startswith(prefix):
+                item_id = entries[index][1]
+                if item_id not in found:
+                    found.append(item_id)
+                index += 1
+        return [(item_id, self.items[item_id][1]) for item_id in found]
+
+class AutocompleteIndex:
+    def __init__(self, refresh_interval=30):
+        self.refresh_interval = refresh_interval
+        self.indexes = {name: NameIndex() for name in CATALOG_TYPES}
+        self.revisions = {}
+        # table -> ids written by this worker, read on the next lookup
+        self.pending = {}
+        self.checked_at = None
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def refresh(self, session):
+        """Bring every collection whose revision moved up to date."""
+        current = dict(session.execute(select(CollectionRevision.name, CollectionRevision.revision)).all())
+        for name, model in CATALOG_TYPES.items():
+            revision = current.get(name, 0)
+            if self.revisions.get(name) == revision:
+                continue
+            index = self.indexes[name]
+            if self.revisions.get(name) is None:
+                rows = session.execute(select(model.id, model.revision, model.name)).all()
+                with self._lock:
+                    index.load(rows)
+            else:
+                # Only the rows whose revision changed are read again; a row
+                # revision is never handed out twice, even when an id is reused
+                versions = dict(session.execute(select(model.id, model.revision)).all())
+                stale = [item_id for item_id, item_revision in versions.items()
+                         if index.items.get(item_id, (None,))[0] != item_revision]
+                rows = []
+                for start in range(0, len(stale), 500):
+                    rows += session.execute(select(model.id, model.revision, model.name).where(
+                        model.id.in_(stale[start:start + 500]))).all()
+                with self._lock:
+                    for item_id in [item_id for item_id in index.items if item_id not in versions]:
+                        index.remove(item_id)
+                    for item_id, item_revision, item_name in rows:
+                        index.add(item_id, item_revision, item_name)
+            self.revisions[name] = revision
+        self.checked_at = time.monotonic()
+
+    def maybe_refresh(self, session):
+        if self.checked_at is not None and time.monotonic() - self.checked_at < self.refresh_interval:
+            return
+        # Build once under the lock; later checks are done by one thread while
+        # the others keep answering from the current index
+        if self.checked_at is None:
+            with self._refreshing:
+                if self.checked_at is None:
+                    self.refresh(session)
+        elif self._refreshing.acquire(blocking=False):
+            try:
+                self.refresh(session)
+            finally:
+                self._refreshing.release()
+
+    def apply(self, changes):
+        """Catalog change listener: drop deleted rows, queue the written ones.
+
+        Runs after commit, where no query may be made: the committing session
+        is done and opening another connection could wait for a pool that the
+        request itself keeps busy."""
+        if self.checked_at is None:
+            return
+        with self._lock:
+            for table, item_id, action in changes:
+                if table not in self.indexes:
+                    continue
+                if action == "delete":
+                    self.indexes[table].remove(item_id)
+                    self.pending.get(table, set()).discard(item_id)
+                else:
+                    self.pending.setdefault(table, set()).add(item_id)
+
+    def load_pending(self, session):
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        for table, ids in pending.items():
+            model = CATALOG_TYPES[table]
+            ids = sorted(ids)
+            for start in range(0, len(ids), 500):
+                rows = session.execute(select(model.id, model.revision, model.name).where(
+                    model.id.in_(ids[start:start + 500]))).all()
+                with self._lock:
+                    for item_id, revision, name in rows:
+                        self.indexes[table].add(item_id, revision, name)
+
+    def lookup(self, session, prefix, types, limit):
+        """[(type, id, name), ...] for names or words of names starting with prefix."""
+        self.maybe_refresh(session)
+        if self.pending:
+            self.load_pending(session)
+        prefix = normalize(prefix)
+        results = []
+        with self._lock:
+            for name in types:
+                results += [(name, item_id, item_name) for item_id, item_name in self.indexes[name].lookup(prefix, limit)]
+        if len(types) > 1:
+            results.sort(key=lambda result: (not normalize(result[2]).startswith(prefix), normalize(result[2]), result[1]))
+        return results[:limit]
@@ -0,0 +1,156 @@
+"""
+Batch create/update/delete for the catalog models. A batch is validated as a
+whole first (errors are reported per item index) and then written in a single
+transaction with executemany statements instead of one ORM object per row.
+Core statements skip the ORM flush hooks, so revisions and change
+notifications are recorded here explicitly.
+"""
+from sqlalchemy import bindparam, insert, update, delete, select
+from models import db, utcnow, bump_collection_revision, record_catalog_changes
+
+# Columns maintained by the server, never accepted from clients
+MANAGED_COLUMNS = ('id', 'revision', 'updated_at')
+CHUNK_SIZE = 1000
+
+def writable_columns(model):
+    return [column for column in model.__table__.columns if column.name not in MANAGED_COLUMNS]
+
+def validate_item(model, data, partial=False):
+    if not isinstance(data, dict):
+        return ["item must be an object"]
+
+    errors = []
+    columns = {column.name: column for column in writable_columns(model)}
+    for key in data:
+        if key not in columns and key != 'id':
+            errors.append("unknown field '%s'" % key)
+
+    for name, column in columns.items():
+        if name not in data:
+            if not partial and not column.nullable:
+                errors.append("'%s' is required" % name)
+            continue
+        value = data[name]
+        if value is None:
+            if not column.nullable:
+                errors.append("'%s' can not be null" % name)
+        elif column.type.python_type is int:
+            if not isinstance(value, int) or isinstance(value, bool):
+                errors.append("'%s' must be an integer" % name)
+        elif not isinstance(value, str):
+            errors.append("'%s' must be a string" % name)
+        elif column.type.length is not None and len(value) > column.type.length:
+            errors.append("'%s' is longer than %d characters" % (name, column.type.length))
+    return errors
+
+def existing_ids(model, ids):
+    found = set()
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        found.update(db.session.scalars(select(model.id).where(model.id.in_(chunk))))
+    return found
+
+def chunks(items):
+    for start in range(0, len(items), CHUNK_SIZE):
+        yield items[start:start + CHUNK_SIZE]
+
+def bulk_create(model, items):
+    errors = []
+    for index, item in enumerate(items):
+        item_errors = validate_item(model, item)
+        if isinstance(item, dict) and 'id' in item:
+            item_errors.append("'id' is assigned by the server")
+        if item_errors:
+            errors.append({"index": index, "errors": item_errors})
+    if errors:
+        return None, errors
+
+    table = model.__tablename__
+    revision = bump_collection_revision(db.session.connection(), table)
+    names = [column.name for column in writable_columns(model)]
+    now = utcnow()
+    rows = [dict({name: item.get(name) for name in names}, revision=revision, updated_at=now) for item in items]
+
+    ids = []
+    if db.engine.dialect.insert_executemany_returning:
+        for chunk in chunks(rows):
+            ids.extend(db.session.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), chunk))
+    else:
+        # No RETURNING with executemany (MySQL): one INSERT per row, so every
+        # new id is known to the response and to the change listeners
+        statement = insert(model.__table__)
+        for row in rows:
+            ids.append(db.session.execute(statement, row).inserted_primary_key[0])
+
+    record_catalog_changes(db.session, [(table, item_id, "insert") for item_id in ids])
+    db.session.commit()
+    return ids, None
+
+def bulk_update(model, items):
+    errors = []
+    for index, item in enumerate(items):
+        item_errors = validate_item(model, item, partial=True)
+        if isinstance(item, dict) and not isinstance(item.get('id'), int):
+            item_errors.append("'id' is required")
+        if item_errors:
+            errors.append({"index": index, "errors": item_errors})
+
+    if not errors:
+        ids = [item['id'] for item in items]
+        found = existing_ids(model, ids)
+        seen = set()
+        for index, item_id in enumerate(ids):
+            if item_id not in found:
+                errors.append({"index": index, "errors": ["id %d not found" % item_id]})
+            elif item_id in seen:
+                errors.append({"index": index, "errors": ["id %d appears more than once" % item_id]})
+            seen.add(item_id)
+    if errors:
+        return None, errors
+
+    # executemany needs the same parameters on every row, so group the
+    # partial updates by the set of fields they touch
+    groups = {}
+    for item in items:
+        fields = tuple(sorted(key for key in item if key != 'id'))
+        groups.setdefault(fields, []).append(item)
+
+    revision = bump_collection_revision(db.session.connection(), model.__tablename__)
+    table = model.__table__
+    now = utcnow()
+    for fields, group in groups.items():
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam('_id'))
+            .values(revision=revision, updated_at=now,
+                    **{field: bindparam('_' + field) for field in fields})
+        )
+        rows = [{'_' + key: value for key, value in item.items()} for item in group]
+        for chunk in chunks(rows):
+            db.session.execute(statement, chunk)
+
+    record_catalog_changes(db.session, [(model.__tablename__, item['id'], "update") for item in items])
+    db.session.commit()
+    return len(items), None
+
+def bulk_delete(model, ids):
+    errors = []
+    for index, item_id in enumerate(ids):
+        if not isinstance(item_id, int) or isinstance(item_id, bool):
+            errors.append({"index": index, "errors": ["id must be an integer"]})
+    if not errors:
+        found = existing_ids(model, ids)
+        for index, item_id in enumerate(ids):
+            if item_id not in found:
+                errors.append({"index": index, "errors": ["id %d not found" % item_id]})
+    if errors:
+        return None, errors
+
+    ids = list(set(ids))
+    for chunk in chunks(ids):
+        db.session.execute(delete(model.__table__).where(model.__table__.c.id.in_(chunk)))
+
+    bump_collection_revision(db.session.connection(), model.__tablename__)
+    record_catalog_changes(db.session, [(model.__tablename__, item_id, "delete") for item_id in ids])
+    db.session.commit()
+    return len(ids), None
@@ -0,0 +1,156 @@
+"""
+Flask CLI commands, available next to the Flask-Migrate ones:
+
+    $ flask catalog import people ./people.ndjson --batch-size 5000
+    $ flask catalog import planets ./planets.csv
+    $ flask favorites rebuild-counts
+"""
+import csv
+import io
+import json
+import time
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, insert, select
+from models import db, utcnow, Characters, Planets, Vehicles, bump_collection_revision, record_catalog_changes
+from bulk import validate_item, writable_columns
+from favorites import rebuild_counts
+
+catalog_cli = AppGroup('catalog', help='Import and maintain the catalog tables.')
+
+IMPORTABLE = {"people": Characters, "planets": Planets, "vehicles": Vehicles}
+
+# SQLite refuses statements with more bound parameters than this
+SQLITE_MAX_VARIABLES = 999
+
+def read_ndjson(stream):
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if line:
+            try:
+                yield number, json.loads(line)
+            except ValueError as error:
+                yield number, error
+
+def read_csv(stream, model):
+    integer_columns = {column.name for column in writable_columns(model) if column.type.python_type is int}
+    for number, row in enumerate(csv.DictReader(stream), start=2):
+        item = {}
+        for key, value in row.items():
+            if value == "":
+                value = None
+            elif key in integer_columns:
+                try:
+                    value = int(value)
+                except ValueError:
+                    pass  # reported by validate_item
+            item[key] = value
+        yield number, item
+
+def copy_rows(connection, model, names, rows):
+    # psycopg2 only: COPY is the fastest way to load rows into PostgreSQL
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["\\N" if row[name] is None else row[name] for name in names])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            "COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL '\\N')" % (model.__tablename__, ", ".join(names)),
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+def insert_rows(connection, model, names, rows):
+    dialect = connection.dialect
+    if dialect.name == 'postgresql' and dialect.driver == 'psycopg2':
+        copy_rows(connection, model, names, rows)
+    elif dialect.name == 'sqlite':
+        # One multi-row INSERT ... VALUES (...), (...) per statement-sized chunk
+        per_statement = max(1, SQLITE_MAX_VARIABLES // len(names))
+        for start in range(0, len(rows), per_statement):
+            connection.execute(insert(model.__table__).values(rows[start:start + per_statement]))
+    else:
+        connection.execute(insert(model.__table__), rows)
+
+@catalog_cli.command('import')
+@click.argument('collection', type=click.Choice(sorted(IMPORTABLE)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['ndjson', 'csv']), default=None,
+              help='File format, guessed from the extension when omitted.')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows written and committed per batch.')
+@click.option('--skip-invalid', is_flag=True, help='Report and skip invalid rows instead of stopping.')
+def import_catalog(collection, path, file_format, batch_size, skip_invalid):
+    """Stream an NDJSON or CSV file into the people, planets or vehicles table."""
+    model = IMPORTABLE[collection]
+    if file_format is None:
+        file_format = 'csv' if path.endswith('.csv') else 'ndjson'
+
+    names = [column.name for column in writable_columns(model)] + ['revision', 'updated_at']
+    started = time.monotonic()
+    imported = skipped = 0
+    batch = []
+
+    def flush():
+        nonlocal imported
+        connection = db.session.connection()
+        revision = bump_collection_revision(connection, model.__tablename__)
+        for row in batch:
+            row['revision'] = revision
+        # COPY and multi-row VALUES return no ids. Other writers of the table
+        # wait on the revision row bumped above, so the new rows are the ones
+        # past the current highest id that carry this batch's revision
+        last_id = connection.execute(select(func.max(model.id))).scalar() or 0
+        insert_rows(connection, model, names, batch)
+        ids = connection.execute(
+            select(model.id).where(model.id > last_id, model.revision == revision)
+        ).scalars().all()
+        record_catalog_changes(db.session, [(model.__tablename__, item_id, "insert") for item_id in ids])
+        db.session.commit()
+        imported += len(batch)
+        batch.clear()
+        elapsed = time.monotonic() - started
+        click.echo("%d rows imported (%.0f rows/s)" % (imported, imported / elapsed if elapsed else 0))
+
+    with open(path, encoding='utf-8', newline='') as stream:
+        rows = read_csv(stream, model) if file_format == 'csv' else read_ndjson(stream)
+        for number, item in rows:
+            errors = ["invalid JSON: %s" % item] if isinstance(item, Exception) else validate_item(model, item)
+            if isinstance(item, dict) and 'id' in item:
+                errors.append("'id' is assigned by the database")
+            if errors:
+                message = "line %d: %s" % (number, "; ".join(errors))
+                if not skip_invalid:
+                    db.session.rollback()
+                    raise click.ClickException(message + " (%d rows were imported before it)" % imported)
+                click.echo(message, err=True)
+                skipped += 1
+                continue
+
+            now = utcnow()
+            batch.append(dict({name: item.get(name) for name in names[:-2]}, revision=None, updated_at=now))
+            if len(batch) >= batch_size:
+                flush()
+
+        if batch:
+            flush()
+
+    elapsed = time.monotonic() - started
+    click.echo("Done: %d rows imported, %d skipped in %.2fs (%.0f rows/s)" % (
+        imported, skipped, elapsed, imported / elapsed if elapsed else 0))
+
+favorites_cli = AppGroup('favorites', help='Maintain the favorites tables.')
+
+@favorites_cli.command('rebuild-counts')
+def rebuild_favorite_counts():
+    """Recompute favorite_counts from the favorites table."""
+    started = time.monotonic()
+    rebuild_counts(db.session)
+    db.session.commit()
+    click.echo("favorite_counts rebuilt in %.2fs" % (time.monotonic() - started))
+
+def setup_commands(app):
+    app.cli.add_command(catalog_cli)
+    app.cli.add_command(favorites_cli)
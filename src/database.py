@@ -0,0 +1,182 @@
+"""
+Engine and connection pool settings, read from the environment.
+
+    DB_MAX_CONNECTIONS      total connections this deployment may open; split
+                            evenly between the WEB_CONCURRENCY workers
+    DB_POOL_SIZE            connections kept open per worker (overrides the split)
+    DB_MAX_OVERFLOW         extra connections a worker may open under load
+    DB_POOL_TIMEOUT         seconds to wait for a free connection
+    DB_POOL_RECYCLE         seconds after which a connection is replaced
+    DB_POOL_PRE_PING        test connections before handing them out (true/false)
+    DB_STATEMENT_TIMEOUT_MS abort statements running longer than this
+    DB_USE_NULLPOOL         open a connection per checkout, for use behind pgbouncer
+
+Read replicas (DATABASE_REPLICA_URLS, comma separated) are used by the GET
+handlers marked with @use_replica, one replica for all the reads of a request.
+Everything else, and any read that follows a write in the same request, goes
+to the primary. Locally this can be tried
+with a copy of the SQLite file:
+
+    $ cp /tmp/test.db /tmp/replica.db
+    $ DATABASE_REPLICA_URLS=sqlite:////tmp/replica.db pipenv run start
+"""
+import itertools
+import os
+import threading
+import time
+from functools import wraps
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import NullPool, QueuePool
+
+def env_int(name, default=None):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+def env_bool(name, default=False):
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+def engine_options(database_url):
+    options = {}
+    connect_args = {}
+    backend = database_url.split(":", 1)[0].split("+", 1)[0]
+
+    # SQLite is a local file: the pool settings below only matter for servers
+    if backend != "sqlite":
+        if env_bool("DB_USE_NULLPOOL"):
+            options["poolclass"] = NullPool
+        else:
+            workers = env_int("WEB_CONCURRENCY", 1)
+            total = env_int("DB_MAX_CONNECTIONS")
+            if total is not None:
+                pool_size, max_overflow = max(1, total // max(1, workers)), 0
+            else:
+                pool_size, max_overflow = 5, 10
+            options["pool_size"] = env_int("DB_POOL_SIZE", pool_size)
+            options["max_overflow"] = env_int("DB_MAX_OVERFLOW", max_overflow)
+            options["pool_timeout"] = env_int("DB_POOL_TIMEOUT", 30)
+            options["pool_recycle"] = env_int("DB_POOL_RECYCLE", 1800)
+        options["pool_pre_ping"] = env_bool("DB_POOL_PRE_PING", True)
+
+    timeout = env_int("DB_STATEMENT_TIMEOUT_MS")
+    if timeout:
+        if backend == "postgresql":
+            connect_args["options"] = "-c statement_timeout=%d" % timeout
+        elif backend == "mysql":
+            connect_args["init_command"] = "SET SESSION max_execution_time=%d" % timeout
+
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+class PoolStats:
+    """Counts pool events of one engine, on top of what the pool reports itself."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        event.listen(engine.pool, "connect", self._on_connect)
+        event.listen(engine.pool, "checkout", self._on_checkout)
+        event.listen(engine.pool, "invalidate", self._on_invalidate)
+
+    def _increment(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self._increment("connects")
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self._increment("checkouts")
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        self._increment("invalidations")
+
+    def to_dict(self):
+        pool = self.engine.pool
+        result = {
+            "url": self.engine.url.render_as_string(hide_password=True),
+            "pool": type(pool).__name__,
+            "status": pool.status(),
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "invalidations": self.invalidations,
+        }
+        if isinstance(pool, QueuePool):
+            result.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=pool.overflow(),
+            )
+        return result
+
+class ReplicaRouter:
+    """Round-robin over the replicas (per request), skipping the ones that recently failed."""
+
+    def __init__(self, urls, retry_after=30):
+        self.engines = [create_engine(url, **engine_options(url)) for url in urls]
+        self.retry_after = retry_after
+        self._down_until = {}
+        self._counter = itertools.count()
+        for engine in self.engines:
+            event.listen(engine, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        # Lost connections and failed connection attempts take the replica out
+        if context.engine is not None and (context.is_disconnect or context.connection is None):
+            self.mark_down(context.engine)
+
+    def mark_down(self, engine):
+        self._down_until[engine] = time.monotonic() + self.retry_after
+
+    def _ping(self, engine):
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            return True
+        except Exception:
+            self.mark_down(engine)
+            return False
+
+    def choose(self):
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._counter) % len(self.engines)]
+            down_until = self._down_until.get(engine)
+            if down_until is None:
+                return engine
+            if down_until <= time.monotonic() and self._ping(engine):
+                self._down_until.pop(engine, None)
+                return engine
+        return None
+
+class RoutingSession(Session):
+    router = None
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.router is not None and has_app_context() and g.get("use_replica"):
+            if self._flushing or getattr(clause, "is_dml", False):
+                # From here on the request reads its own writes from the primary
+                g.use_replica = False
+            else:
+                # One replica per request, so every read of the request sees
+                # the same point of the replication stream
+                if "replica" not in g:
+                    g.replica = self.router.choose()
+                if g.replica is not None:
+                    return g.replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def use_replica(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
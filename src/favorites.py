@@ -0,0 +1,165 @@
+"""
+Favorites are a set per user: (user_id, type, target) is unique, and adding
+an existing favorite is a no-op instead of a duplicate row.
+
+favorite_counts keeps how many users favorited each target. It is adjusted
+in the same transaction as every insert/delete made through this module and
+can be rebuilt with `flask favorites rebuild-counts` if it ever drifts
+(e.g. after edits through Flask-Admin).
+"""
+from sqlalchemy import insert, select, delete, update, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from models import Favorites, FavoriteCount, CATALOG_TYPES
+
+# Favorite type -> column holding the referenced id
+TARGET_COLUMNS = {
+    'characters': 'char_id',
+    'planets': 'planet_id',
+    'vehicles': 'vehicle_id',
+}
+
+# The public URLs say "people" where the model says "characters"
+TYPE_ALIASES = {'people': 'characters'}
+
+ACTIONS = ('add', 'remove')
+
+class TargetNotFound(Exception):
+    """A favorite points at a character, planet or vehicle that does not exist."""
+
+def check_targets(session, favorite_type, target_ids):
+    # Checked up front: SQLite does not enforce the foreign keys by default and
+    # MySQL's INSERT IGNORE turns their violations into warnings
+    model = CATALOG_TYPES[favorite_type]
+    target_ids = set(target_ids)
+    found = set(session.scalars(select(model.id).where(model.id.in_(target_ids))))
+    if found != target_ids:
+        raise TargetNotFound("%s %s not found" % (favorite_type, ", ".join(str(item) for item in sorted(target_ids - found))))
+
+def favorite_key(user_id, favorite_type, target_id):
+    column = getattr(Favorites, TARGET_COLUMNS[favorite_type])
+    return (Favorites.user_id == user_id, Favorites.type == favorite_type, column == target_id)
+
+def upsert_favorite(session, user_id, favorite_type, target_id, check_target=True):
+    """Insert the favorite unless it exists. Returns True if a row was created.
+
+    Raises TargetNotFound when the target does not exist."""
+    if check_target:
+        check_targets(session, favorite_type, [target_id])
+    values = {"user_id": user_id, "type": favorite_type, TARGET_COLUMNS[favorite_type]: target_id}
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        statement = postgresql_insert(Favorites.__table__).values(**values).on_conflict_do_nothing()
+    elif dialect == 'sqlite':
+        statement = sqlite_insert(Favorites.__table__).values(**values).on_conflict_do_nothing()
+    elif dialect == 'mysql':
+        statement = insert(Favorites.__table__).values(**values).prefix_with('IGNORE')
+    else:
+        # No native upsert: rely on the unique index inside a savepoint
+        try:
+            with session.begin_nested():
+                session.execute(insert(Favorites.__table__).values(**values))
+        except IntegrityError:
+            return False
+        adjust_count(session, favorite_type, target_id, 1)
+        return True
+
+    created = session.execute(statement).rowcount == 1
+    if created:
+        adjust_count(session, favorite_type, target_id, 1)
+    return created
+
+def find_favorite(session, user_id, favorite_type, target_id):
+    return session.scalars(select(Favorites).where(*favorite_key(user_id, favorite_type, target_id))).first()
+
+def remove_favorite(session, user_id, favorite_type, target_id):
+    """Delete the favorite if present. Returns True if a row was removed."""
+    statement = delete(Favorites.__table__).where(*favorite_key(user_id, favorite_type, target_id))
+    removed = session.execute(statement).rowcount > 0
+    if removed:
+        adjust_count(session, favorite_type, target_id, -1)
+    return removed
+
+def adjust_count(session, favorite_type, target_id, delta):
+    table = FavoriteCount.__table__
+    key = (table.c.type == favorite_type, table.c.target_id == target_id)
+    if delta < 0:
+        session.execute(update(table).where(*key, table.c.count > 0).values(count=table.c.count + delta))
+        return
+
+    dialect = session.get_bind().dialect.name
+    values = {"type": favorite_type, "target_id": target_id, "count": delta}
+    if dialect == 'postgresql':
+        statement = postgresql_insert(table).values(**values)
+        statement = statement.on_conflict_do_update(index_elements=['type', 'target_id'], set_={"count": table.c.count + delta})
+    elif dialect == 'sqlite':
+        statement = sqlite_insert(table).values(**values)
+        statement = statement.on_conflict_do_update(index_elements=['type', 'target_id'], set_={"count": table.c.count + delta})
+    elif dialect == 'mysql':
+        statement = mysql_insert(table).values(**values).on_duplicate_key_update(count=table.c.count + delta)
+    else:
+        if session.execute(update(table).where(*key).values(count=table.c.count + delta)).rowcount == 0:
+            session.execute(insert(table).values(**values))
+        return
+    session.execute(statement)
+
+def top_targets(session, favorite_type, limit):
+    """[(target_id, count), ...] read straight off the (type, count) index."""
+    table = FavoriteCount.__table__
+    statement = (
+        select(table.c.target_id, table.c.count)
+        .where(table.c.type == favorite_type, table.c.count > 0)
+        .order_by(table.c.count.desc(), table.c.target_id.desc())
+        .limit(limit)
+    )
+    return session.execute(statement).all()
+
+def rebuild_counts(session):
+    table = FavoriteCount.__table__
+    target = func.coalesce(Favorites.char_id, Favorites.planet_id, Favorites.vehicle_id)
+    counts = (
+        select(Favorites.type, target, func.count())
+        .group_by(Favorites.type, target)
+    )
+    session.execute(delete(table))
+    session.execute(insert(table).from_select(['type', 'target_id', 'count'], counts))
+
+def validate_operations(operations):
+    errors = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            errors.append({"index": index, "errors": ["operation must be an object"]})
+            continue
+        problems = []
+        favorite_type = operation.get('type')
+        if not isinstance(favorite_type, str) or TYPE_ALIASES.get(favorite_type, favorite_type) not in TARGET_COLUMNS:
+            problems.append("'type' must be one of: people, " + ", ".join(TARGET_COLUMNS))
+        target_id = operation.get('id')
+        if not isinstance(target_id, int) or isinstance(target_id, bool):
+            problems.append("'id' must be an integer")
+        if operation.get('action') not in ACTIONS:
+            problems.append("'action' must be one of: " + ", ".join(ACTIONS))
+        if problems:
+            errors.append({"index": index, "errors": problems})
+    return errors
+
+def apply_operations(session, user_id, operations):
+    """Apply already validated operations in order, without committing.
+
+    Raises TargetNotFound, before writing anything, when an added target does
+    not exist."""
+    added = {}
+    for operation in operations:
+        if operation['action'] == 'add':
+            added.setdefault(TYPE_ALIASES.get(operation['type'], operation['type']), []).append(operation['id'])
+    for favorite_type, target_ids in added.items():
+        check_targets(session, favorite_type, target_ids)
+
+    for operation in operations:
+        favorite_type = TYPE_ALIASES.get(operation['type'], operation['type'])
+        if operation['action'] == 'add':
+            upsert_favorite(session, user_id, favorite_type, operation['id'], check_target=False)
+        else:
+            remove_favorite(session, user_id, favorite_type, operation['id'])
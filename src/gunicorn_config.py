@@ -0,0 +1,79 @@
+"""
+Gunicorn settings, used by the Procfile and `python src/wsgi.py`:
+
+    $ gunicorn wsgi --chdir ./src/ -c src/gunicorn_config.py
+
+Everything can be overridden from the environment or the command line.
+
+    WEB_CONCURRENCY         worker processes, 2 x CPUs + 1 by default (capped by
+                            GUNICORN_MAX_WORKERS); also used by database.py to
+                            split DB_MAX_CONNECTIONS between the workers
+    GUNICORN_THREADS        threads per worker; more than 1 switches to gthread
+    GUNICORN_WORKER_CLASS   sync, gthread, or uvicorn.workers.UvicornWorker with asgi:application
+    GUNICORN_PRELOAD        import the app once in the master (true/false)
+    GUNICORN_MAX_REQUESTS   recycle a worker after this many requests (0 = never)
+    GUNICORN_KEEPALIVE      seconds to keep idle client connections open
+    GUNICORN_TIMEOUT        seconds before a silent worker is killed and restarted
+"""
+import os
+
+def env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+def cpu_count():
+    # Only the CPUs this process may run on, which is what containers limit
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+workers = env_int("WEB_CONCURRENCY", min(2 * cpu_count() + 1, env_int("GUNICORN_MAX_WORKERS", 12)))
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+threads = env_int("GUNICORN_THREADS", 1)
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread" if threads > 1 else "sync")
+
+# Flask-Admin, the models and the caches are imported once and shared
+# copy-on-write by the workers instead of being imported by each of them
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes", "on")
+
+# Restarting workers now and then bounds slow leaks; the jitter keeps them
+# from all restarting at the same moment
+max_requests = env_int("GUNICORN_MAX_REQUESTS", 2000)
+max_requests_jitter = env_int("GUNICORN_MAX_REQUESTS_JITTER", max_requests // 10)
+
+keepalive = env_int("GUNICORN_KEEPALIVE", 5)
+timeout = env_int("GUNICORN_TIMEOUT", 30)
+graceful_timeout = env_int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+
+# Heartbeat files on a tmpfs, so a slow disk can not get workers killed
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+def when_ready(server):
+    # Load the in-memory autocomplete index once in the master, so preloaded
+    # workers start with it instead of each querying every name
+    if not preload_app:
+        return
+    from app import app, autocomplete_index
+    from models import db
+    with app.app_context():
+        try:
+            autocomplete_index.refresh(db.session)
+        except Exception:
+            server.log.exception("could not load the autocomplete index, workers will load it on first use")
+        finally:
+            db.session.remove()
+
+def post_fork(server, worker):
+    # With preload_app the engines were created in the master: drop the
+    # inherited pools (without closing the master's sockets) so every worker
+    # opens its own connections
+    from app import app
+    from database import RoutingSession
+    from models import db
+    with app.app_context():
+        db.engine.dispose(close=False)
+    if RoutingSession.router is not None:
+        for engine in RoutingSession.router.engines:
+            engine.dispose(close=False)
@@ -0,0 +1,116 @@
+"""
+Per-request SQL statistics, collected from the engine events of every engine
+(primary, replicas and the async one), so nothing in the handlers changes.
+
+For each request this records the number of statements, the time spent in
+the database and the slowest statements. It then:
+
+- adds a Server-Timing header (db and app durations), which browsers show in
+  their network panel;
+- logs one JSON line on the "sql" logger, at INFO, or at WARNING when the
+  request looks like an N+1: the same statement run SQL_REPEAT_THRESHOLD
+  times or more, or run twice with the very same parameters.
+"""
+import json
+import logging
+import time
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("sql")
+
+class RequestQueries:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        # statement -> [executions, total seconds, slowest seconds]
+        self.statements = {}
+        self._seen = set()
+        self.duplicates = {}
+
+    def record(self, statement, parameters, duration, executemany):
+        self.count += 1
+        self.duration += duration
+        stats = self.statements.setdefault(statement, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = max(stats[2], duration)
+        if not executemany:
+            key = (statement, repr(parameters))
+            if key in self._seen:
+                self.duplicates[statement] = self.duplicates.get(statement, 1) + 1
+            self._seen.add(key)
+
+    def slowest(self, count):
+        ranked = sorted(self.statements.items(), key=lambda item: item[1][2], reverse=True)
+        return [{"statement": shorten(statement), "ms": round(stats[2] * 1000, 3), "executions": stats[0]}
+                for statement, stats in ranked[:count]]
+
+    def repeated(self, threshold):
+        return [{"statement": shorten(statement), "executions": stats[0]}
+                for statement, stats in self.statements.items() if stats[0] >= threshold]
+
+def shorten(statement, length=200):
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= length else statement[:length] + "..."
+
+def current_queries():
+    return g.get("sql_queries") if has_app_context() else None
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_timer(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_query(connection, cursor, statement, parameters, context, executemany):
+    started = connection.info["query_started"].pop()
+    queries = current_queries()
+    if queries is not None:
+        queries.record(statement, parameters, time.perf_counter() - started, executemany)
+
+@event.listens_for(Engine, "handle_error")
+def discard_timer(context):
+    # A failed statement never reaches after_cursor_execute
+    if context.connection is not None and context.connection.info.get("query_started"):
+        context.connection.info["query_started"].pop()
+
+def setup_instrumentation(app):
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+    slowest = app.config['SQL_SLOWEST_STATEMENTS']
+    threshold = app.config['SQL_REPEAT_THRESHOLD']
+
+    @app.before_request
+    def start_request_queries():
+        g.sql_queries = RequestQueries()
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def report_request_queries(response):
+        queries = g.get("sql_queries")
+        if queries is None:
+            return response
+        elapsed = time.perf_counter() - g.request_started
+        if app.config['SQL_SERVER_TIMING']:
+            response.headers.add("Server-Timing", 'db;dur=%.2f;desc="%d queries"' % (queries.duration * 1000, queries.count))
+            response.headers.add("Server-Timing", "app;dur=%.2f" % (elapsed * 1000))
+
+        repeated = queries.repeated(threshold)
+        duplicated = [{"statement": shorten(statement), "executions": count} for statement, count in queries.duplicates.items()]
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "queries": queries.count,
+            "db_ms": round(queries.duration * 1000, 3),
+            "total_ms": round(elapsed * 1000, 3),
+            "slowest": queries.slowest(slowest),
+        }
+        if repeated or duplicated:
+            record.update(repeated=repeated, duplicated=duplicated)
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+        return response
@@ -1,6 +1,14 @@
+import logging
+from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, select
+from database import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+logger = logging.getLogger(__name__)
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 class User(db.Model):
     __tablename__='user'
@@ -9,7 +17,7 @@ class User(db.Model):
     firstname = db.Column(db.String(250), nullable=False)
     lastname = db.Column(db.String(250), nullable=False)
     email = db.Column(db.String(250), nullable=False, unique=True)
-    password = db.Column(db.String(80), unique=False, nullable=False)
+    password = db.Column(db.String(255), unique=False, nullable=False)
     is_active = db.Column(db.Boolean(), unique=False, nullable=True)
 
     def __repr__(self):
@@ -26,16 +34,31 @@ class User(db.Model):
 
 class Favorites(db.Model):
     __tablename__='favorites'
+    __table_args__ = (
+        db.Index('uq_favorites_user_type_char', 'user_id', 'type', 'char_id', unique=True),
+        db.Index('uq_favorites_user_type_planet', 'user_id', 'type', 'planet_id', unique=True),
+        db.Index('uq_favorites_user_type_vehicle', 'user_id', 'type', 'vehicle_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     type = db.Column(db.Enum("characters", "planets", "vehicles", name="favorites_types"), nullable=False)
     char_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=True)
     planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'), nullable=True)
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), nullable=True)
+    character = db.relationship('Characters')
+    planet = db.relationship('Planets')
+    vehicle = db.relationship('Vehicles')
 
     def __repr__(self):
         return '<Favorites %r>' % self.user_id
 
+    def target(self):
+        if self.type == 'characters':
+            return self.character
+        elif self.type == 'planets':
+            return self.planet
+        return self.vehicle
+
     def serialize(self):
         if self.type == 'characters':
             return {
@@ -61,6 +84,12 @@ class Favorites(db.Model):
 
 class Characters(db.Model):
     __tablename__='characters'
+    __table_args__ = (
+        db.Index('ix_characters_name_id', 'name', 'id'),
+        db.Index('ix_characters_gender_id', 'gender', 'id'),
+    )
+    # Columns clients may filter and sort on, each backed by an index above
+    filter_fields = ('name', 'gender')
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(250), nullable=False)
     description = db.Column(db.String(250), nullable=False)
@@ -69,6 +98,8 @@ class Characters(db.Model):
     gender = db.Column(db.String(250), nullable=False)
     skin_color = db.Column(db.String(250), nullable=True)
     eye_color = db.Column(db.String(250), nullable=False)
+    revision = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, server_default=db.func.now())
 
     def __repr__(self):
         return '<Characters %r>' % self.name
@@ -87,6 +118,14 @@ class Characters(db.Model):
 
 class Planets(db.Model):
     __tablename__='planets'
+    __table_args__ = (
+        db.Index('ix_planets_name_id', 'name', 'id'),
+        db.Index('ix_planets_climate_id', 'climate', 'id'),
+        db.Index('ix_planets_terrain_id', 'terrain', 'id'),
+        db.Index('ix_planets_diameter_id', 'diameter', 'id'),
+        db.Index('ix_planets_population_id', 'population', 'id'),
+    )
+    filter_fields = ('name', 'climate', 'terrain', 'diameter', 'population')
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(250), nullable=False)
     description = db.Column(db.String(250), nullable=False)
@@ -96,6 +135,8 @@ class Planets(db.Model):
     population = db.Column(db.Integer, nullable=True)
     climate = db.Column(db.String(250), nullable=False)
     terrain = db.Column(db.String(250), nullable=True)
+    revision = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, server_default=db.func.now())
 
     def __repr__(self):
         return '<Planets %r>' % self.name
@@ -115,6 +156,14 @@ class Planets(db.Model):
     
 class Vehicles(db.Model):
     __tablename__='vehicles'
+    __table_args__ = (
+        db.Index('ix_vehicles_name_id', 'name', 'id'),
+        db.Index('ix_vehicles_vehicle_class_id', 'vehicle_class', 'id'),
+        db.Index('ix_vehicles_manufacturer_id', 'manufacturer', 'id'),
+        db.Index('ix_vehicles_crew_id', 'crew', 'id'),
+        db.Index('ix_vehicles_cargo_capacity_id', 'cargo_capacity', 'id'),
+    )
+    filter_fields = ('name', 'vehicle_class', 'manufacturer', 'crew', 'cargo_capacity')
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(250), nullable=False)
     description = db.Column(db.String(250), nullable=False)
@@ -124,6 +173,8 @@ class Vehicles(db.Model):
     length = db.Column(db.Integer, nullable=False)  
     crew = db.Column(db.Integer, nullable=False) 
     cargo_capacity = db.Column(db.Integer, nullable=False) 
+    revision = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, server_default=db.func.now())
 
     def __repr__(self):
         return '<Vehicles %r>' % self.name
@@ -139,4 +190,128 @@ class Vehicles(db.Model):
             "length": self.length,
             "crew": self.crew,
             "cargo_capacity": self.cargo_capacity
-        }
\ No newline at end of file
+        }
+
+class FavoriteCount(db.Model):
+    __tablename__='favorite_counts'
+    __table_args__ = (
+        db.Index('ix_favorite_counts_type_count', 'type', 'count', 'target_id'),
+    )
+    type = db.Column(db.String(20), primary_key=True)
+    target_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<FavoriteCount %r %r>' % (self.type, self.target_id)
+
+class CollectionRevision(db.Model):
+    __tablename__='collection_revisions'
+    name = db.Column(db.String(50), primary_key=True)
+    revision = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return '<CollectionRevision %r>' % self.name
+
+class TokenRevocation(db.Model):
+    __tablename__='token_revocations'
+    __table_args__ = (
+        db.Index('ix_token_revocations_revoked_at', 'revoked_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    # Either one token (jti) or every token of a user issued up to revoked_at
+    jti = db.Column(db.String(64), nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    revoked_at = db.Column(db.Float, nullable=False)
+    expires_at = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return '<TokenRevocation %r>' % (self.jti or self.user_id)
+
+# Catalog type (table name, as used by favorites, search and autocomplete) -> model
+CATALOG_TYPES = {"characters": Characters, "planets": Planets, "vehicles": Vehicles}
+CATALOG_MODELS = tuple(CATALOG_TYPES.values())
+
+def bump_collection_revision(connection, name):
+    """Move the collection revision forward and return the new value.
+
+    Written rows take this value as their own revision, so a row revision is
+    never handed out twice in a collection, not even to a row that reuses the
+    id of a deleted one.
+    """
+    table = CollectionRevision.__table__
+    now = utcnow()
+    result = connection.execute(
+        table.update()
+        .where(table.c.name == name)
+        .values(revision=table.c.revision + 1, updated_at=now)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(name=name, revision=1, updated_at=now))
+        return 1
+    return connection.execute(select(table.c.revision).where(table.c.name == name)).scalar_one()
+
+# Code that keeps derived state (caches, snapshots, indexes) in sync with the
+# catalog registers here and is called with [(table, id, action), ...] once the
+# transaction that made those changes has committed.
+catalog_listeners = []
+
+def on_catalog_change(listener):
+    catalog_listeners.append(listener)
+    return listener
+
+def record_catalog_changes(session, changes):
+    session.info.setdefault("catalog_changes", []).extend(changes)
+
+# Every ORM write to the catalog (API handlers and Flask-Admin alike) goes
+# through a flush, so this is the one place that keeps the row and collection
+# revisions used for ETags up to date.
+@event.listens_for(db.session, "before_flush")
+def track_catalog_revisions(session, flush_context, instances):
+    written = []
+    deleted = []
+    for obj in session.new:
+        if isinstance(obj, CATALOG_MODELS):
+            written.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, CATALOG_MODELS) and session.is_modified(obj, include_collections=False):
+            written.append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, CATALOG_MODELS):
+            deleted.append(obj)
+    touched = sorted({obj.__tablename__ for obj in written + deleted})
+    if not touched:
+        return
+
+    revisions = {name: bump_collection_revision(session.connection(), name) for name in touched}
+    now = utcnow()
+    changes = []
+    for obj in written:
+        obj.revision = revisions[obj.__tablename__]
+        obj.updated_at = now
+        if obj not in session.new:
+            changes.append((obj.__tablename__, obj.id, "update"))
+    changes += [(obj.__tablename__, obj.id, "delete") for obj in deleted]
+    record_catalog_changes(session, changes)
+
+@event.listens_for(db.session, "after_flush")
+def record_catalog_inserts(session, flush_context):
+    # New rows only have their primary key once the INSERT has run
+    record_catalog_changes(session, [
+        (obj.__tablename__, obj.id, "insert") for obj in session.new if isinstance(obj, CATALOG_MODELS)
+    ])
+
+@event.listens_for(db.session, "after_commit")
+def notify_catalog_listeners(session):
+    changes = session.info.pop("catalog_changes", None)
+    if not changes:
+        return
+    for listener in catalog_listeners:
+        try:
+            listener(changes)
+        except Exception:
+            logger.exception("catalog listener %r failed", listener)
+
+@event.listens_for(db.session, "after_rollback")
+def discard_catalog_changes(session):
+    session.info.pop("catalog_changes", None)
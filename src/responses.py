@@ -0,0 +1,128 @@
+"""
+Response encoding: a faster JSON provider and Content-Encoding negotiation.
+
+orjson, brotli and zstandard are optional. Without orjson the app keeps
+Flask's own provider; encodings whose module is missing are simply not
+offered, and gzip is always available.
+
+    COMPRESS_MIN_SIZE   bodies smaller than this (bytes) are sent as is
+    COMPRESS_ENCODINGS  encodings offered, in order of preference on ties
+"""
+import gzip
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask's provider with orjson doing the work. Key order and the handling
+    of dates, decimals and other extra types are the same; non-ASCII text is
+    sent as UTF-8 instead of \\u escapes."""
+
+    def _option(self, indent=False):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumpb(self, obj, indent=False):
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._option(indent))
+        except orjson.JSONEncodeError:
+            # e.g. integers wider than 64 bits
+            return super().dumps(obj, indent=2 if indent else None, separators=None if indent else (",", ":")).encode("utf-8")
+
+    def dumps(self, obj, **kwargs):
+        if set(kwargs) - {"indent", "separators"}:
+            return super().dumps(obj, **kwargs)
+        return self.dumpb(obj, bool(kwargs.get("indent"))).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.dumpb(obj, indent) + b"\n", mimetype=self.mimetype)
+
+def setup_json(app):
+    if orjson is not None:
+        app.json = FastJSONProvider(app)
+
+# Quick levels for bodies compressed per request, stronger ones for the
+# variants cached with the collection snapshots, which are compressed once
+# per revision
+LEVELS = {
+    "dynamic": {"gzip": 6, "br": 4, "zstd": 3},
+    "cached": {"gzip": 9, "br": 9, "zstd": 12},
+}
+
+def compress(data, encoding, level):
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+def available_encodings(preferred):
+    modules = {"gzip": gzip, "br": brotli, "zstd": zstandard}
+    return [encoding for encoding in preferred if modules.get(encoding) is not None]
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/html", "text/plain")
+
+def setup_compression(app):
+    encodings = available_encodings(app.config['COMPRESS_ENCODINGS'])
+    min_size = app.config['COMPRESS_MIN_SIZE']
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+        response.vary.add("Accept-Encoding")
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or "Content-Encoding" in response.headers):
+            return response
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding is None:
+            return response
+
+        # Handlers can attach a dict of already compressed bodies (see
+        # CollectionSnapshot.variants) that is filled on first use
+        variants = getattr(response, "compressed_variants", None)
+        if variants is not None:
+            compressed = variants.get(encoding)
+            if compressed is None:
+                compressed = variants[encoding] = compress(data, encoding, LEVELS["cached"][encoding])
+        else:
+            compressed = compress(data, encoding, LEVELS["dynamic"][encoding])
+        if len(compressed) >= len(data):
+            return response
+
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        # The encoded bytes differ from the identity ones, so the validator
+        # becomes weak (as nginx does); If-None-Match still matches weakly
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,169 @@
+"""
+Full-text search over the name and description of the catalog.
+
+Three interchangeable backends, picked on first use (SEARCH_BACKEND=auto):
+
+- PostgreSQL: a weighted tsvector expression with a GIN index per table
+  (migration a4d1e6b20c97), ranked with ts_rank.
+- SQLite: FTS5 tables kept in sync by triggers (same migration), ranked
+  with bm25.
+- Anything else, or SEARCH_BACKEND=memory: an inverted index in the memory
+  of each worker. Like the collection snapshots it follows the collection
+  revisions, reloading only the rows whose revision moved (row revisions
+  are never reused, even with the id), so writes made through any path or
+  worker show up on the next search.
+
+Every backend matches all the words of the query and weighs a match in the
+name above one in the description. Words are stemmed by the database
+backends and matched exactly by the in-memory one.
+"""
+import math
+import re
+import threading
+from sqlalchemy import inspect, select, text
+from models import CollectionRevision, CATALOG_TYPES
+
+
+# Must stay identical to the indexed expression in the migration
+TSVECTOR = "setweight(to_tsvector('english', name), 'A') || setweight(to_tsvector('english', description), 'B')"
+
+NAME_WEIGHT = 2.0
+
+def tokenize(value):
+    return re.findall(r"\w+", value.lower())
+
+class PostgresSearch:
+    name = "postgresql"
+
+    def search(self, session, query, types, limit, offset):
+        selects = [
+            "SELECT '%s' AS type, id, ts_rank(%s, query) AS rank "
+            "FROM %s, plainto_tsquery('english', :q) query WHERE %s @@ query" % (name, TSVECTOR, name, TSVECTOR)
+            for name in types
+        ]
+        statement = text(" UNION ALL ".join(selects) + " ORDER BY rank DESC, type, id LIMIT :limit OFFSET :offset")
+        return session.execute(statement, {"q": query, "limit": limit, "offset": offset}).all()
+
+class SQLiteSearch:
+    name = "sqlite"
+
+    def search(self, session, query, types, limit, offset):
+        # Quoted terms: the words are matched, FTS5 operators in the query are not run
+        match = " ".join('"%s"' % term for term in tokenize(query))
+        selects = [
+            "SELECT '%s' AS type, rowid AS id, -bm25(%s_search, %s, 1.0) AS rank "
+            "FROM %s_search WHERE %s_search MATCH :q" % (name, name, NAME_WEIGHT, name, name)
+            for name in types
+        ]
+        statement = text(" UNION ALL ".join(selects) + " ORDER BY rank DESC, type, id LIMIT :limit OFFSET :offset")
+        return session.execute(statement, {"q": match, "limit": limit, "offset": offset}).all()
+
+class MemorySearch:
+    name = "memory"
+
+    def __init__(self):
+        # term -> {(type, id): score contribution before idf}
+        self.postings = {}
+        # (type, id) -> (revision, terms)
+        self.documents = {}
+        self.revisions = {}
+        self._lock = threading.Lock()
+
+    def _remove(self, key):
+        revision, terms = self.documents.pop(key)
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(key, None)
+            if not postings:
+                del self.postings[term]
+
+    def _add(self, key, revision, name, description):
+        weights = {}
+        for term in tokenize(name):
+            weights[term] = weights.get(term, 0) + NAME_WEIGHT
+        for term in tokenize(description):
+            weights[term] = weights.get(term, 0) + 1.0
+        for term, weight in weights.items():
+            self.postings.setdefault(term, {})[key] = weight
+        self.documents[key] = (revision, tuple(weights))
+
+    def _sync(self, session, name, revision):
+        model = CATALOG_TYPES[name]
+        versions = dict(session.query(model.id, model.revision).all())
+        stale = [item_id for item_id, item_revision in versions.items()
+                 if (name, item_id) not in self.documents or self.documents[(name, item_id)][0] != item_revision]
+        for start in range(0, len(stale), 500):
+            rows = session.query(model.id, model.revision, model.name, model.description).filter(
+                model.id.in_(stale[start:start + 500]))
+            for item_id, item_revision, item_name, description in rows:
+                if (name, item_id) in self.documents:
+                    self._remove((name, item_id))
+                self._add((name, item_id), item_revision, item_name, description)
+        for key in [key for key in self.documents if key[0] == name and key[1] not in versions]:
+            self._remove(key)
+        self.revisions[name] = revision
+
+    def refresh(self, session, types):
+        current = dict(session.query(CollectionRevision.name, CollectionRevision.revision).filter(
+            CollectionRevision.name.in_(types)).all())
+        with self._lock:
+            for name in types:
+                revision = current.get(name, 0)
+                if self.revisions.get(name) != revision:
+                    self._sync(session, name, revision)
+
+    def search(self, session, query, types, limit, offset):
+        self.refresh(session, types)
+        terms = set(tokenize(query))
+        with self._lock:
+            postings = [self.postings.get(term, {}) for term in terms]
+            if not postings or not all(postings):
+                return []
+            total = len(self.documents)
+            scores = None
+            for matches in sorted(postings, key=len):
+                idf = math.log(1 + total / len(matches))
+                if scores is None:
+                    scores = {key: weight * idf for key, weight in matches.items() if key[0] in types}
+                else:
+                    scores = {key: score + matches[key] * idf for key, score in scores.items() if key in matches}
+        ranked = sorted(scores.items(), key=lambda entry: (-entry[1], entry[0]))
+        return [(key[0], key[1], score) for key, score in ranked[offset:offset + limit]]
+
+def detect_backend(session, preference="auto"):
+    if preference == "memory":
+        return MemorySearch()
+    bind = session.get_bind()
+    if bind.dialect.name == "postgresql":
+        return PostgresSearch()
+    if bind.dialect.name == "sqlite" and inspect(bind).has_table("characters_search"):
+        return SQLiteSearch()
+    return MemorySearch()
+
+class CatalogSearch:
+    """Picks the backend lazily, so importing the app never touches the database."""
+
+    def __init__(self, preference="auto"):
+        self.preference = preference
+        self.backend = None
+        self._lock = threading.Lock()
+
+    def search(self, session, query, types, limit, offset):
+        """[(type, id, rank), ...] best first."""
+        if self.backend is None:
+            with self._lock:
+                if self.backend is None:
+                    self.backend = detect_backend(session, self.preference)
+        return self.backend.search(session, query, types, limit, offset)
+
+def load_results(session, hits):
+    """The entities of the hits, in the order of the hits."""
+    ids = {}
+    for name, item_id, rank in hits:
+        ids.setdefault(name, []).append(item_id)
+    items = {}
+    for name, type_ids in ids.items():
+        model = CATALOG_TYPES[name]
+        for item in session.scalars(select(model).where(model.id.in_(type_ids))):
+            items[(name, item.id)] = item
+    return [(name, items[(name, item_id)], rank) for name, item_id, rank in hits if (name, item_id) in items]
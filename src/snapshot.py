@@ -0,0 +1,61 @@
+"""
+Pre-encoded JSON bodies for the full (unpaginated) catalog collections.
+
+Each snapshot keeps the encoded bytes of every row next to the row revision.
+When the collection revision moves, only the (id, revision) pairs are read
+back; rows whose revision changed are reloaded and re-encoded, removed rows
+are dropped, and the body is joined again. Row revisions are drawn from the
+collection counter (see bump_collection_revision), so a row that reuses the
+id of a deleted one never matches the bytes cached for the old row. Steady-state responses are just
+the cached bytes, and compressed copies of the body are kept next to it until
+the next revision (see variants()).
+"""
+import threading
+
+class CollectionSnapshot:
+    chunk_size = 500
+
+    def __init__(self, model, encode):
+        self.model = model
+        self.encode = encode
+        self.rows = {}
+        self._current = (None, None, {})
+        self._lock = threading.Lock()
+
+    def get(self, session, revision):
+        current_revision, body, variants = self._current
+        if body is not None and current_revision == revision:
+            return body
+
+        with self._lock:
+            current_revision, body, variants = self._current
+            if body is None or current_revision != revision:
+                body = self._sync(session)
+                self._current = (revision, body, {})
+            return body
+
+    def variants(self, body):
+        """Encoding -> compressed bytes cache for a body returned by get()."""
+        current_revision, current_body, variants = self._current
+        return variants if current_body is body else {}
+
+    def invalidate(self):
+        with self._lock:
+            self.rows = {}
+            self._current = (None, None, {})
+
+    def _sync(self, session):
+        model = self.model
+        versions = dict(session.query(model.id, model.revision).all())
+
+        stale = [item_id for item_id, revision in versions.items()
+                 if item_id not in self.rows or self.rows[item_id][0] != revision]
+        for start in range(0, len(stale), self.chunk_size):
+            chunk = stale[start:start + self.chunk_size]
+            for item in session.query(model).filter(model.id.in_(chunk)):
+                self.rows[item.id] = (item.revision, self.encode(item.serialize()))
+
+        for item_id in [item_id for item_id in self.rows if item_id not in versions]:
+            del self.rows[item_id]
+
+        return b"[" + b",".join(self.rows[item_id][1] for item_id in sorted(self.rows)) + b"]\n"
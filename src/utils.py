@@ -1,4 +1,9 @@
+import base64
+import json
+import operator
 from flask import jsonify, url_for
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import load_only
 
 class APIException(Exception):
     status_code = 400
@@ -39,3 +44,175 @@ def generate_sitemap(app):
         <p>Start working on your proyect by following the <a href="https://start.4geeksacademy.com/starters/flask" target="_blank">Quick Start</a></p>
         <p>Remember to specify a real endpoint path like: </p>
         <ul style="text-align: left;">"""+links_html+"</ul></div>"
+
+
+# Keyset pagination: the cursor holds the sort value and primary key of the
+# last row of the previous page, so every page is an index range scan no
+# matter how deep the client goes.
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, TypeError):
+        raise APIException("Invalid cursor", status_code=400)
+    if not isinstance(values, dict) or not isinstance(values.get("id"), int) or isinstance(values["id"], bool):
+        raise APIException("Invalid cursor", status_code=400)
+    # The sort value is compared against a column: only scalars get that far
+    value = values.get("v")
+    if value is not None and (not isinstance(value, (str, int, float)) or isinstance(value, bool)):
+        raise APIException("Invalid cursor", status_code=400)
+    return values
+
+def parse_int_arg(args, name, default=None, minimum=0, maximum=None):
+    value = args.get(name, None)
+    if value is None or value == "":
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise APIException("'%s' must be an integer" % name, status_code=400)
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise APIException("'%s' is out of range" % name, status_code=400)
+    return value
+
+def wants_pagination(args):
+    return "limit" in args or "after" in args or "offset" in args
+
+# Sparse fieldsets: ?fields=id,name limits both the SELECT and the payload
+
+HIDDEN_COLUMNS = ('revision', 'updated_at')
+
+def parse_fields(model, args):
+    if not args.get("fields"):
+        return None
+    public = [column.name for column in model.__table__.columns if column.name not in HIDDEN_COLUMNS]
+    fields = [name.strip() for name in args["fields"].split(",") if name.strip()]
+    unknown = [name for name in fields if name not in public]
+    if unknown:
+        raise APIException("Unknown fields: %s, use any of: %s" % (", ".join(unknown), ", ".join(public)), status_code=400)
+    return fields
+
+def load_fields(query, model, fields, sort=("id", False)):
+    # The sort column is needed to build the next cursor, even if not returned
+    names = set(fields) | {sort[0]}
+    return query.options(load_only(*[getattr(model, name) for name in names]))
+
+def serialize_fields(item, fields):
+    return {name: getattr(item, name) for name in fields}
+
+# Filtering and sorting are limited to the columns listed in each model's
+# filter_fields, which are the ones backed by an index. Strings filter by
+# equality (?climate=arid), integers also by range (?diameter_min=&diameter_max=).
+
+def is_integer_column(column):
+    return column.type.python_type is int
+
+def wants_filtering(model, args):
+    for name in model.filter_fields:
+        if name in args or name + "_min" in args or name + "_max" in args:
+            return True
+    return "sort" in args
+
+def apply_filters(query, model, args):
+    for name in model.filter_fields:
+        column = model.__table__.c[name]
+        if is_integer_column(column):
+            # Empty values are ignored, like the empty range bounds
+            if args.get(name):
+                query = query.filter(column == parse_int_arg(args, name, minimum=None))
+            if args.get(name + "_min"):
+                query = query.filter(column >= parse_int_arg(args, name + "_min", minimum=None))
+            if args.get(name + "_max"):
+                query = query.filter(column <= parse_int_arg(args, name + "_max", minimum=None))
+        elif name in args:
+            query = query.filter(column == args[name])
+    return query
+
+def parse_sort(model, args):
+    sort = args.get("sort", "") or "id"
+    descending = sort.startswith("-")
+    name = sort.lstrip("-")
+    if name != "id" and name not in model.filter_fields:
+        raise APIException("Can not sort by '%s', use one of: id, %s" % (name, ", ".join(model.filter_fields)), status_code=400)
+    return name, descending
+
+def sort_order(model, sort):
+    name, descending = sort
+    column, id_column = model.__table__.c[name], model.__table__.c.id
+    direction = (lambda col: col.desc()) if descending else (lambda col: col.asc())
+    if name == "id":
+        return [direction(id_column)]
+    # NULLs always come last, whatever the database default is
+    order = [column.is_(None)] if column.nullable else []
+    return order + [direction(column), direction(id_column)]
+
+def keyset_condition(model, sort, cursor):
+    name, descending = sort
+    column, id_column = model.__table__.c[name], model.__table__.c.id
+    after = operator.lt if descending else operator.gt
+    if name == "id":
+        return after(id_column, cursor["id"])
+
+    value = cursor.get("v")
+    if value is None:
+        # The previous page already reached the trailing NULLs
+        return and_(column.is_(None), after(id_column, cursor["id"]))
+    condition = or_(after(column, value), and_(column == value, after(id_column, cursor["id"])))
+    if column.nullable:
+        condition = or_(condition, column.is_(None))
+    return condition
+
+def paginate(query, model, args, sort=("id", False), default_limit=50, max_limit=500, max_offset=1000):
+    query, limit, offset = page_query(query, model, args, sort, default_limit, max_limit, max_offset)
+    return page_results(query.all(), sort, limit, offset)
+
+# paginate() in two halves, so the async handlers can run the query themselves
+
+def page_query(query, model, args, sort=("id", False), default_limit=50, max_limit=500, max_offset=1000):
+    """Return (query, limit, offset) with ordering, the cursor and the LIMIT applied."""
+    limit = parse_int_arg(args, "limit", default_limit, minimum=1, maximum=max_limit)
+    offset = parse_int_arg(args, "offset")
+    order = sort_order(model, sort)
+
+    # Offset paging is only a fallback for small tables: the database still has
+    # to walk every skipped row, so deep offsets are refused.
+    if offset is not None:
+        if "after" in args:
+            raise APIException("Use either 'after' or 'offset', not both", status_code=400)
+        if offset + limit > max_offset:
+            raise APIException("Offset paging is limited to the first %d rows, use the 'after' cursor instead" % max_offset, status_code=400)
+        return query.order_by(*order).offset(offset).limit(limit), limit, offset
+
+    sort_key = ("-" if sort[1] else "") + sort[0]
+    if args.get("after"):
+        cursor = decode_cursor(args["after"])
+        if cursor.get("s", "id") != sort_key:
+            raise APIException("The cursor was created for a different sort order", status_code=400)
+        query = query.filter(keyset_condition(model, sort, cursor))
+
+    # Fetch one extra row to know whether there is a next page without a COUNT(*)
+    return query.order_by(*order).limit(limit + 1), limit, None
+
+def page_results(items, sort, limit, offset):
+    """Return (items, next_cursor, next_offset) for the rows fetched by page_query()."""
+    if offset is not None:
+        next_offset = offset + limit if len(items) == limit else None
+        return items, None, next_offset
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        sort_key = ("-" if sort[1] else "") + sort[0]
+        values = {"id": last.id}
+        if sort[0] != "id":
+            values.update(s=sort_key, v=getattr(last, sort[0]))
+        elif sort[1]:
+            values["s"] = sort_key
+        next_cursor = encode_cursor(values)
+    return items, next_cursor, None
@@ -1,7 +1,17 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
 
-from app import app as application
+import os
+import sys
 
 if __name__ == "__main__":
-    application.run()
+    # Run the production server with the settings in gunicorn_config.py. The
+    # app is imported by gunicorn after the config has set WEB_CONCURRENCY,
+    # which database.py uses to split DB_MAX_CONNECTIONS between the workers.
+    # For the development server use `pipenv run start` (flask run).
+    from gunicorn.app.wsgiapp import run
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.argv = ["gunicorn", "-c", os.path.join(here, "gunicorn_config.py"), "--chdir", here, "wsgi:application"] + sys.argv[1:]
+    run()
+else:
+    from app import app as application
@@ -0,0 +1,68 @@
+"""
+Shared fixtures: the app runs against a throwaway SQLite file built by the
+migrations, with a cheap password hash so logins stay fast.
+
+    $ pipenv run test
+"""
+import itertools
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix="starwars-tests-"), "test.db")
+
+# app.py reads its configuration at import time
+os.environ["DATABASE_URL"] = "sqlite:///" + DATABASE_PATH
+os.environ["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+os.environ["JWT_REVOCATION_SYNC_SECONDS"] = "0"
+os.environ["SQL_INSTRUMENTATION"] = "false"
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from flask_migrate import upgrade  # noqa: E402
+from app import app as flask_app  # noqa: E402
+from models import db, Characters  # noqa: E402
+
+usernames = itertools.count(1)
+
+@pytest.fixture(scope="session")
+def app():
+    with flask_app.app_context():
+        upgrade(directory=os.path.join(ROOT, "migrations"))
+        db.session.remove()
+    yield flask_app
+    with flask_app.app_context():
+        db.engine.dispose()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def login(client):
+    """Register a new user and return (user_id, headers with its token)."""
+    def login():
+        username = "user%d" % next(usernames)
+        response = client.post('/register', json={
+            "username": username, "firstname": "Test", "lastname": "User",
+            "email": username + "@example.com", "password": "secret",
+        })
+        assert response.status_code < 300, response.get_json()
+        response = client.post('/login', json={"username": username, "password": "secret"})
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        return body["user_id"], {"Authorization": "Bearer " + body["token"]}
+    return login
+
+@pytest.fixture
+def auth(login):
+    return login()[1]
+
+@pytest.fixture
+def character(app):
+    with app.app_context():
+        item = Characters(name="Luke Skywalker", description="Farm boy", gender="male", eye_color="blue")
+        db.session.add(item)
+        db.session.commit()
+        return item.id
@@ -0,0 +1,53 @@
+"""
+Catalog writes with a pool of one connection: anything that needs a second
+connection while the request holds the first (e.g. an after-commit listener
+querying through the engine) waits out the pool timeout and fails.
+"""
+import time
+import pytest
+from sqlalchemy import create_engine
+from models import db
+
+POOL_TIMEOUT = 2
+
+@pytest.fixture
+def single_connection(app, monkeypatch):
+    with app.app_context():
+        db.session.remove()
+        engine = create_engine(db.engine.url, pool_size=1, max_overflow=0, pool_timeout=POOL_TIMEOUT)
+        monkeypatch.setattr(db.engine, "pool", engine.pool)
+    yield
+    engine.dispose()
+
+def person(name):
+    return {"name": name, "description": "Pilot", "hair_color": "brown", "birth_year": "19BBY",
+            "gender": "female", "skin_color": "fair", "eye_color": "brown"}
+
+def timed(call, *args, **kwargs):
+    started = time.monotonic()
+    response = call(*args, **kwargs)
+    elapsed = time.monotonic() - started
+    assert elapsed < POOL_TIMEOUT, "waited %.1fs for a connection" % elapsed
+    return response
+
+def names(response):
+    return [item["name"] for item in response.get_json()]
+
+def test_create_update_delete_with_one_connection(client, auth, single_connection):
+    response = timed(client.post, '/people', json=person("Jyn Erso"), headers=auth)
+    assert response.status_code == 201
+    item_id = response.get_json()["id"]
+    assert "Jyn Erso" in names(timed(client.get, '/autocomplete?prefix=jyn', headers=auth))
+
+    response = timed(client.put, '/people/%d' % item_id, json=person("Jynx Erso"), headers=auth)
+    assert response.status_code == 200
+    assert "Jynx Erso" in names(timed(client.get, '/autocomplete?prefix=jynx', headers=auth))
+
+    assert timed(client.delete, '/people/%d' % item_id, headers=auth).status_code == 200
+    assert "Jynx Erso" not in names(timed(client.get, '/autocomplete?prefix=jynx', headers=auth))
+
+def test_bulk_create_with_one_connection(client, auth, single_connection):
+    response = timed(client.post, '/people/bulk', json=[person("Cassian Andor"), person("Cassian Jeron")], headers=auth)
+    assert response.status_code == 201
+    assert len(response.get_json()["ids"]) == 2
+    assert {"Cassian Andor", "Cassian Jeron"} <= set(names(timed(client.get, '/autocomplete?prefix=cassian', headers=auth)))
@@ -0,0 +1,55 @@
+from sqlalchemy import select
+from models import db, Favorites, FavoriteCount
+from favorites import rebuild_counts
+
+def favorite_count(app, target_id):
+    with app.app_context():
+        return db.session.scalar(select(FavoriteCount.count).where(
+            FavoriteCount.type == 'characters', FavoriteCount.target_id == target_id))
+
+def favorite_rows(app, user_id, target_id):
+    with app.app_context():
+        return len(db.session.scalars(select(Favorites).where(
+            Favorites.user_id == user_id, Favorites.char_id == target_id)).all())
+
+def test_adding_twice_keeps_one_favorite(app, client, login, character):
+    user_id, headers = login()
+    assert client.post('/favorites/people/%d' % character, headers=headers).status_code == 201
+    assert client.post('/favorites/people/%d' % character, headers=headers).status_code == 200
+    assert favorite_rows(app, user_id, character) == 1
+    assert favorite_count(app, character) == 1
+
+def test_deleting_twice_counts_once(app, client, login, character):
+    user_id, headers = login()
+    _, other = login()
+    client.post('/favorites/people/%d' % character, headers=headers)
+    client.post('/favorites/people/%d' % character, headers=other)
+    assert favorite_count(app, character) == 2
+
+    assert client.delete('/favorites/people/%d' % character, headers=headers).status_code == 200
+    assert client.delete('/favorites/people/%d' % character, headers=headers).status_code == 404
+    assert favorite_rows(app, user_id, character) == 0
+    assert favorite_count(app, character) == 1
+
+def test_missing_target_is_not_counted(app, client, auth):
+    assert client.post('/favorites/people/999999', headers=auth).status_code == 404
+    assert favorite_count(app, 999999) is None
+
+def test_batch_is_idempotent(app, client, auth, character):
+    operations = [{"action": "add", "type": "people", "id": character}] * 2
+    assert client.post('/favorites/batch', json=operations, headers=auth).status_code == 200
+    assert favorite_count(app, character) == 1
+    operations = [{"action": "remove", "type": "people", "id": character}] * 2
+    assert client.post('/favorites/batch', json=operations, headers=auth).status_code == 200
+    assert favorite_count(app, character) == 0
+
+def test_rebuild_counts_matches_the_favorites(app, client, login, character):
+    for _ in range(3):
+        client.post('/favorites/people/%d' % character, headers=login()[1])
+    with app.app_context():
+        # Drift the counter, as an edit through Flask-Admin would
+        db.session.get(FavoriteCount, ('characters', character)).count = 42
+        db.session.commit()
+        rebuild_counts(db.session)
+        db.session.commit()
+    assert favorite_count(app, character) == 3
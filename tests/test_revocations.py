@@ -0,0 +1,48 @@
+import time
+from flask_jwt_extended import decode_token
+from auth import DatabaseRevocations
+from models import db
+
+def payload(jti="unrelated", user_id=1, issued_at=None):
+    return {"jti": jti, "sub": user_id, "iat": time.time() if issued_at is None else issued_at}
+
+def test_revoked_token_reaches_other_workers(app):
+    # Two instances stand for two worker processes sharing the database
+    worker, other = DatabaseRevocations(3600, sync_interval=0), DatabaseRevocations(3600, sync_interval=0)
+    with app.app_context():
+        assert not other.is_revoked(payload("token-1"))
+        worker.revoke_token("token-1")
+        db.session.commit()
+        assert worker.is_revoked(payload("token-1"))
+    with app.app_context():
+        assert other.is_revoked(payload("token-1"))
+        assert not other.is_revoked(payload("token-2"))
+
+def test_uncommitted_revocation_is_not_shared(app):
+    worker, other = DatabaseRevocations(3600, sync_interval=0), DatabaseRevocations(3600, sync_interval=0)
+    with app.app_context():
+        worker.revoke_token("token-3")
+        db.session.rollback()
+    with app.app_context():
+        assert not other.is_revoked(payload("token-3"))
+
+def test_revoked_user_only_loses_older_tokens(app):
+    worker, other = DatabaseRevocations(3600, sync_interval=0), DatabaseRevocations(3600, sync_interval=0)
+    issued = time.time() - 10
+    with app.app_context():
+        worker.revoke_user(7)
+        db.session.commit()
+    with app.app_context():
+        assert other.is_revoked(payload(user_id=7, issued_at=issued))
+        assert not other.is_revoked(payload(user_id=7, issued_at=time.time() + 10))
+        assert not other.is_revoked(payload(user_id=8, issued_at=issued))
+
+def test_logout_revokes_for_every_worker(app, client, auth):
+    assert client.get('/people', headers=auth).status_code == 200
+    assert client.post('/logout', headers=auth).status_code == 200
+    assert client.get('/people', headers=auth).status_code == 401
+
+    token = auth["Authorization"].split()[1]
+    with app.app_context():
+        claims = decode_token(token, allow_expired=True)
+        assert DatabaseRevocations(3600, sync_interval=0).is_revoked(claims)